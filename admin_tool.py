@@ -42,7 +42,7 @@ def setup_user(order_id, ops_source_path, config_type):
             "trading_stations_count": 2,
             "manufacturing_stations_count": 4,
             "Fiammetta": {"enable": True},
-            "drones": {"enable": True, "order": "pre", "targets": ["LMD", "Pure Gold", "LMD"]}
+            "drones": {"enable": True, "order": "auto", "targets": ["LMD", "Pure Gold", "LMD"]}
         },
         "333": {
             "layout": "3-3-3",
@@ -54,11 +54,14 @@ def setup_user(order_id, ops_source_path, config_type):
             "trading_stations_count": 3,
             "manufacturing_stations_count": 3,
             "Fiammetta": {"enable": True},
-            "drones": {"enable": True, "order": "pre", "targets": ["LMD", "Pure Gold", "LMD"]}
+            "drones": {"enable": True, "order": "auto", "targets": ["LMD", "Pure Gold", "LMD"]}
         }
     }
 
-    selected_config = config_templates.get(config_type, config_templates["243"])
+    if config_type == "auto":
+        selected_config = search_best_config(ops_source_path, config_templates["243"])
+    else:
+        selected_config = config_templates.get(config_type, config_templates["243"])
 
     with open(os.path.join(target_dir, "config.json"), "w", encoding='utf-8') as f:
         json.dump(selected_config, f, indent=2, ensure_ascii=False)
@@ -69,10 +72,24 @@ def setup_user(order_id, ops_source_path, config_type):
     print(f"数据路径: {target_dir}")
 
 
+def search_best_config(ops_source_path, base_config):
+    """根据客户的干员自动搜索布局与产物分配，返回得分最高的配置"""
+    from logic import search_layouts
+
+    with open(ops_source_path, 'r', encoding='utf-8') as f:
+        ops_data = json.load(f)
+
+    ranked = search_layouts("efficiency.json", ops_data, base_config, top_n=5, workers=os.cpu_count() or 1)
+    print("自动搜索结果 (前5):")
+    for i, item in enumerate(ranked, 1):
+        print(f"  {i}. {item['layout']} {item['config']['product_requirements']} 得分: {item['score']:.1f}")
+    return ranked[0]["config"]
+
+
 # --- 使用示例 ---
 if __name__ == "__main__":
     print("=== MAA 售后数据生成器 ===")
     oid = input("输入闲鱼订单号: ")
     path = input("operators.json 路径 (直接拖入): ").strip('"')
-    c_type = input("配置类型 (243 / 333): ")
+    c_type = input("配置类型 (243 / 333 / auto): ")
     setup_user(oid, path, c_type)
\ No newline at end of file
@@ -1,12 +1,13 @@
+import time
+
+_SCRIPT_START = time.perf_counter()
+
 import streamlit as st
 import json
 import os
 import hashlib
-import copy
-import time
 
-# 假设核心逻辑文件
-from logic import WorkplaceOptimizer
+# 核心逻辑（logic）较重，登录后进入主页面时才导入并加载规则库（见 load_engine），登录页不受影响
 
 # ==========================================
 # 0. 样式与配置
@@ -47,10 +48,37 @@ div.stButton > button:first-child {
 """, unsafe_allow_html=True)
 
 
+# 备选方案的 k-best 搜索最多完整求解的次数（每次点击生成时同步计算）
+ALTERNATIVE_EVALUATIONS = 30
+
 # ==========================================
 # 1. 工具函数
 # ==========================================
 
+@st.cache_resource(show_spinner=False)
+def load_engine():
+    """
+    导入核心逻辑并加载规则库注册表，整个进程只执行一次（Streamlit 每次交互都会重跑脚本）。
+    注册表在后台监视 efficiency.json，修改后自动编译并切换到新版本，无需重启。
+    :return: (logic 模块, 规则库注册表, 耗时统计)
+    """
+    t0 = time.perf_counter()
+    import logic
+    t1 = time.perf_counter()
+    registry = logic.RulebookRegistry("efficiency.json").start()
+    t2 = time.perf_counter()
+    timings = {"import_logic_ms": (t1 - t0) * 1000, "rulebook_ms": (t2 - t1) * 1000}
+    print(f"[startup] import logic {timings['import_logic_ms']:.1f} ms, rulebook {timings['rulebook_ms']:.1f} ms")
+    return logic, registry, timings
+
+
+def create_optimizer(ops_data, conf_data):
+    """按需构建优化器：使用当前版本的规则库，干员与配置直接从内存传入"""
+    logic, registry, _ = load_engine()
+    return logic.WorkplaceOptimizer(None, None, rulebook=registry.current(), operator_data=ops_data,
+                                    config_data=conf_data)
+
+
 def get_user_hash(order_id):
     return hashlib.sha256(order_id.strip().encode('utf-8')).hexdigest()[:16]
 
@@ -69,6 +97,11 @@ def load_user_data(user_hash):
     return None, None
 
 
+def warm_start_path(user_hash):
+    """该客户的热启动存档（上次分析的房间结果与干员快照），练度小改后重新分析时复用"""
+    return os.path.join("user_data", user_hash, "warm_start.pkl")
+
+
 def save_user_data(user_hash, ops_data):
     base_path = os.path.join("user_data", user_hash)
     ops_path = os.path.join(base_path, "operators.json")
@@ -80,31 +113,6 @@ def save_user_data(user_hash, ops_data):
     return False
 
 
-def upgrade_operator_in_memory(operators_data, char_id, char_name, target_elite):
-    """内存修改干员练度"""
-    target_id_str = str(char_id)
-    for op in operators_data:
-        current_id_str = str(op.get('id', ''))
-        current_name = op.get('name', '')
-
-        match = False
-        if current_id_str and current_id_str == target_id_str:
-            match = True
-        elif current_name and current_name == char_name:
-            match = True
-
-        if match:
-            op['elite'] = int(target_elite)
-            op['level'] = 1  # 默认重置为1级，根据需求调整
-            return True, f"{current_name}"
-
-    return False, None
-
-
-def clean_data(d):
-    return {k: v for k, v in d.items() if k != 'raw_results'}
-
-
 # ==========================================
 # 2. 会话状态初始化
 # ==========================================
@@ -123,6 +131,14 @@ if 'suggestions' not in st.session_state:
     st.session_state.suggestions = []
 if 'final_result_ready' not in st.session_state:
     st.session_state.final_result_ready = False
+if 'alternatives' not in st.session_state:
+    st.session_state.alternatives = []
+if 'timings' not in st.session_state:
+    st.session_state.timings = {}
+if 'rulebook_version' not in st.session_state:
+    st.session_state.rulebook_version = None  # 练度建议所用的规则库版本
+if 'final_rulebook_version' not in st.session_state:
+    st.session_state.final_rulebook_version = None  # 已生成排班所用的规则库版本
 
 # ==========================================
 # 3. 登录页
@@ -160,6 +176,9 @@ if not st.session_state.auth_status:
 # ==========================================
 
 else:
+    # 进入主页面即导入核心逻辑并加载规则库（每个进程只执行一次），分析时不再承担这部分耗时
+    st.session_state.timings.update(load_engine()[2])
+
     # --- 侧边栏 ---
     with st.sidebar:
         st.success(f"状态: 已登录")
@@ -167,36 +186,46 @@ else:
         st.caption(f"配置: {st.session_state.user_conf.get('desc', 'Custom')}")
 
         st.divider()
+        timings = st.session_state.timings
+        st.caption(" · ".join(f"{label} {timings[key]:.0f} ms" for key, label in (
+            ("import_logic_ms", "核心导入"), ("rulebook_ms", "规则库"),
+            ("analysis_ms", "分析"), ("render_ms", "渲染")) if key in timings))
         if st.button("退出登录", use_container_width=True):
             st.session_state.clear()
             st.rerun()
 
     st.title("🏭 智能排班生成器")
 
-    # --- 逻辑控制区 ---
+    # 规则库更新后，旧版本上算出的建议和排班全部作废
+    if st.session_state.analysis_done or st.session_state.final_result_ready:
+        current_version = load_engine()[1].current().version
+        if st.session_state.analysis_done and st.session_state.rulebook_version != current_version:
+            st.session_state.analysis_done = False
+            st.session_state.suggestions = []
+            st.toast("规则库已更新，正在重新分析", icon="🔄")
+        if st.session_state.final_result_ready and st.session_state.final_rulebook_version != current_version:
+            st.session_state.final_result_ready = False
+            st.session_state.alternatives = []
 
-    # 临时文件路径定义
-    temp_ops_path = f"temp_{st.session_state.user_hash}.json"
-    temp_conf_path = f"temp_conf_{st.session_state.user_hash}.json"
+    # --- 逻辑控制区 ---
 
     # 1. 自动运行分析 (如果是首次加载或数据已更新)
     if not st.session_state.analysis_done:
         with st.status("正在分析基建潜力...", expanded=True) as status:
             try:
-                # 写入临时文件供算法读取
-                with open(temp_ops_path, "w", encoding='utf-8') as f:
-                    json.dump(st.session_state.user_ops, f)
-                with open(temp_conf_path, "w", encoding='utf-8') as f:
-                    json.dump(st.session_state.user_conf, f)
-
                 # 调用核心算法
-                optimizer = WorkplaceOptimizer("efficiency.json", temp_ops_path, temp_conf_path)
+                t_analysis = time.perf_counter()
+                optimizer = create_optimizer(st.session_state.user_ops, st.session_state.user_conf)
+                optimizer.load_warm_start(warm_start_path(st.session_state.user_hash))
                 curr = optimizer.get_optimal_assignments(ignore_elite=False)
                 pot = optimizer.get_optimal_assignments(ignore_elite=True)
+                optimizer.save_warm_start(warm_start_path(st.session_state.user_hash), curr, pot)
                 upgrades = optimizer.calculate_upgrade_requirements(curr, pot)
 
                 st.session_state.suggestions = upgrades
                 st.session_state.analysis_done = True
+                st.session_state.rulebook_version = curr["rulebook_version"]
+                st.session_state.timings["analysis_ms"] = (time.perf_counter() - t_analysis) * 1000
                 status.update(label="✅ 分析完成", state="complete", expanded=False)
 
                 # 分析完成后刷新显示
@@ -206,22 +235,25 @@ else:
                 status.update(label="❌ 分析出错", state="error")
                 st.error(f"算法错误: {str(e)}")
                 st.stop()
-            finally:
-                if os.path.exists(temp_ops_path): os.remove(temp_ops_path)
-                if os.path.exists(temp_conf_path): os.remove(temp_conf_path)
 
     # 2. 如果已有结果，优先展示下载区 (放在顶部更方便)
     if st.session_state.get('final_result_ready', False):
         st.markdown("### 🎉 排班表已生成")
         result_container = st.container(border=True)
         with result_container:
+            choice = 0
+            if len(st.session_state.alternatives) > 1:
+                # 客户不能使用某位干员时，直接选择已经算好的备选方案
+                choice = st.selectbox("方案选择", range(len(st.session_state.alternatives)),
+                                      format_func=lambda i: st.session_state.alternatives[i]["label"])
+            selected = st.session_state.alternatives[choice]
             c1, c2 = st.columns([1, 1])
             with c1:
-                st.metric("预计最终效率", f"{st.session_state.final_eff:.2f}")
+                st.metric("预计最终效率", f"{selected['eff']:.2f}")
             with c2:
                 st.download_button(
                     label="📥 下载 MAA 排班 JSON",
-                    data=st.session_state.final_result_json,
+                    data=selected["json"],
                     file_name="maa_schedule_optimized.json",
                     mime="application/json",
                     type="primary",
@@ -262,30 +294,29 @@ else:
                     selected_indices.append(idx)
 
         st.markdown("---")
+        # 备选方案需要多次完整求解，只在客户需要时计算
+        want_alternatives = st.checkbox("同时计算备选方案（某位干员不能上岗时可直接切换，耗时较长）")
         # 按钮：生成
         generate_btn = st.form_submit_button("🚀 应用选中修改并生成排班", type="primary", use_container_width=True)
 
     # 4. 处理生成逻辑
     if generate_btn:
         with st.spinner("正在写入数据并重新演算..."):
-            # A. 复制当前数据
-            new_ops_data = copy.deepcopy(st.session_state.user_ops)
+            # A. 在当前数据上叠加练度修改（不复制干员数据）
+            roster = load_engine()[0].RosterOverlay(st.session_state.user_ops)
             modified_names = []
 
             # B. 应用勾选的修改
             for idx in selected_indices:
                 item = st.session_state.suggestions[idx]
-                if item.get('type') == 'bundle':
-                    for o in item['ops']:
-                        suc, name = upgrade_operator_in_memory(new_ops_data, o.get('id'), o.get('name'), o['target'])
-                        if suc: modified_names.append(name)
-                else:
-                    suc, name = upgrade_operator_in_memory(new_ops_data, item.get('id'), item.get('name'),
-                                                           item['target'])
-                    if suc: modified_names.append(name)
+                targets = item['ops'] if item.get('type') == 'bundle' else [item]
+                for o in targets:
+                    roster, name = roster.with_elite(o.get('id'), o.get('name'), o['target'])
+                    if name: modified_names.append(name)
 
             # C. 保存到硬盘 (持久化)
             if modified_names:
+                new_ops_data = roster.to_list()
                 save_success = save_user_data(st.session_state.user_hash, new_ops_data)
                 if not save_success:
                     st.error("保存数据失败，请联系管理员")
@@ -293,25 +324,31 @@ else:
                 st.session_state.user_ops = new_ops_data  # 更新内存
 
             # D. 生成最终排班
-            run_ops_path = f"run_ops_{st.session_state.user_hash}.json"
-            run_conf_path = f"run_conf_{st.session_state.user_hash}.json"
-
             try:
-                with open(run_ops_path, "w", encoding='utf-8') as f:
-                    json.dump(new_ops_data, f, ensure_ascii=False)
-                with open(run_conf_path, "w", encoding='utf-8') as f:
-                    json.dump(st.session_state.user_conf, f, ensure_ascii=False)
-
-                optimizer = WorkplaceOptimizer("efficiency.json", run_ops_path, run_conf_path)
-                final_res = optimizer.get_optimal_assignments(ignore_elite=False)  # 使用新练度计算
-
-                # 提取结果
-                raw_res = final_res.get('raw_results', [])
-                st.session_state.final_eff = raw_res[0].total_efficiency if raw_res else 0
-                st.session_state.final_result_json = json.dumps(clean_data(final_res), ensure_ascii=False, indent=2)
+                optimizer = create_optimizer(roster, st.session_state.user_conf)
+                optimizer.load_warm_start(warm_start_path(st.session_state.user_hash))
+                # 使用新练度计算；勾选时同时给出若干备选方案（第一个即最优方案）
+                if want_alternatives:
+                    alternatives = optimizer.get_top_k_assignments(k=5, ignore_elite=False,
+                                                                   max_evaluations=ALTERNATIVE_EVALUATIONS)
+                else:
+                    alternatives = [{"result": optimizer.get_optimal_assignments(ignore_elite=False),
+                                     "excluded": [], "gap": 0.0}]
+                final_res = alternatives[0]["result"]
+                optimizer.save_warm_start(warm_start_path(st.session_state.user_hash), final_res)
+
+                # 提取结果（效率与导出的 JSON 都按方案保存，切换方案时一起切换）
+                serialize_schedule = load_engine()[0].serialize_schedule
+                st.session_state.alternatives = [{
+                    "label": "最优方案" if i == 0 else
+                    f"备选{i}：不使用 {'、'.join(alt['excluded'])} (效率 -{alt['gap']:.0f}%)",
+                    "eff": alt["result"]["raw_results"][0].total_efficiency if alt["result"].get("raw_results") else 0,
+                    "json": serialize_schedule(alt["result"])
+                } for i, alt in enumerate(alternatives)]
 
                 # E. 状态更新与重载
                 st.session_state.final_result_ready = True
+                st.session_state.final_rulebook_version = final_res["rulebook_version"]
 
                 # 关键：清除分析缓存，促使下次渲染时重新分析 (这样已应用的建议就会消失)
                 st.session_state.analysis_done = False
@@ -328,6 +365,6 @@ else:
 
             except Exception as e:
                 st.error(f"计算发生错误: {e}")
-            finally:
-                if os.path.exists(run_ops_path): os.remove(run_ops_path)
-                if os.path.exists(run_conf_path): os.remove(run_conf_path)
\ No newline at end of file
+
+# 本次脚本执行总耗时（下次渲染时显示在侧边栏）
+st.session_state.timings["render_ms"] = (time.perf_counter() - _SCRIPT_START) * 1000
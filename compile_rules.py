@@ -0,0 +1,58 @@
+# compile_rules.py
+# 校验并编译 efficiency.json：检查干员名、"干员名/精英等级" 格式、不可达/冲突/重复的规则，
+# 并写出编译后的规则库缓存（WorkplaceOptimizer 启动时直接加载）
+import argparse
+import os
+import sys
+
+from logic import RuleBook, load_operator_catalog
+
+LEVEL_ICONS = {'error': '❌', 'warning': '⚠️', 'info': 'ℹ️'}
+
+
+def compile_rules(efficiency_file, catalog_pattern, output=None, show_info=False):
+    """校验规则文件并写出编译产物，返回问题列表"""
+    rulebook = RuleBook.from_file(efficiency_file, use_cache=False)
+    catalog = load_operator_catalog(catalog_pattern) if catalog_pattern else None
+    if catalog is not None:
+        print(f"已知干员目录: {len(catalog)} 名（{catalog_pattern}）")
+    issues = rulebook.validate(catalog)
+
+    for level in ('error', 'warning', 'info'):
+        selected = [issue for issue in issues if issue['level'] == level]
+        if not selected or (level == 'info' and not show_info):
+            continue
+        print(f"\n{LEVEL_ICONS[level]} {level} ({len(selected)})")
+        for issue in selected:
+            print(f"  [{issue['code']}] {issue['where']}: {issue['message']}")
+
+    print("\n规则统计（删除 = 被支配、不会被选中；可跳过 = 支配它的规则可行时跳过）:")
+    for workplace_type, entry in rulebook.dominance_report().items():
+        print(f"  {workplace_type}: {entry['rules']} 条，删除 {entry['pruned']} 条，可跳过 {entry['dominated']} 条")
+
+    if output:
+        rulebook.save(output)  # 指定路径只写这一个文件，不清理同目录的其他文件
+    else:
+        output = RuleBook.cache_path(efficiency_file, rulebook.digest)
+        rulebook._save_cache(output)
+    print(f"\n✅ 已写出编译后的规则库: {output}")
+    return issues
+
+
+def main():
+    parser = argparse.ArgumentParser(description="校验并编译 efficiency.json")
+    parser.add_argument("efficiency_file", nargs="?", default="efficiency.json")
+    parser.add_argument("--catalog", default=os.path.join("user_data", "*", "operators.json"),
+                        help="已知干员目录（operators.json 的 glob），传空字符串则不检查干员名")
+    parser.add_argument("--output", help="编译产物路径，默认写到规则库缓存目录")
+    parser.add_argument("--info", action="store_true", help="同时列出提示信息（如被支配的规则）")
+    parser.add_argument("--strict", action="store_true", help="有警告时也返回非零退出码")
+    args = parser.parse_args()
+
+    issues = compile_rules(args.efficiency_file, args.catalog, args.output, args.info)
+    failing = ('error', 'warning') if args.strict else ('error',)
+    sys.exit(1 if any(issue['level'] in failing for issue in issues) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,24 @@
+import copy
 import datetime
+import hashlib
+import heapq
+import itertools
 import json
-from typing import Dict, List, Any, Optional, Tuple
-from dataclasses import dataclass, field
+import math
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Dict, List, Any, Optional, Tuple, Iterable, Mapping
+from dataclasses import dataclass, field, replace
 
 
 # ----------------- 数据类定义 -----------------
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Operator:
     id: str
     name: str
@@ -17,13 +29,13 @@ class Operator:
     rarity: int
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class RoomRequirement:
     operator: str
     elite_required: int
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class OperatorEfficiency:
     operators: List[str]
     workplace_type: str
@@ -31,15 +43,18 @@ class OperatorEfficiency:
     synergy_efficiency: float
     description: str
     elite_requirements: Dict[str, int]
-    requires_control_center: List[RoomRequirement]
-    requires_dormitory: List[RoomRequirement]
-    requires_power_station: List[RoomRequirement]
-    requires_hire: List[RoomRequirement]
-    requires_processing_station: List[RoomRequirement]  # [新增] 加工站需求
+    requires_control_center: Tuple[RoomRequirement, ...]
+    requires_dormitory: Tuple[RoomRequirement, ...]
+    requires_power_station: Tuple[RoomRequirement, ...]
+    requires_hire: Tuple[RoomRequirement, ...]
+    requires_processing_station: Tuple[RoomRequirement, ...]  # [新增] 加工站需求
     special_conditions: Optional[str] = None
     apply_each: bool = False
     priority: int = 0
     products: List[str] = field(default_factory=list)
+    when: Tuple[Tuple[str, Tuple[Tuple[str, int], ...]], ...] = ()  # 声明式条件，见 PREDICATE_KEYS
+    scale: Tuple[Tuple[str, float], ...] = ()  # 按布局缩放效率，见 SCALE_KEYS
+    rule_id: int = -1  # 在规则库 efficiency_rules 中的下标，结果中通过它引用规则
 
 
 @dataclass
@@ -52,20 +67,20 @@ class Workplace:
     current_product: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class AssignmentResult:
     workplace: Workplace
-    optimal_operators: List[Operator]
+    optimal_operators: Tuple[Operator, ...]
     total_efficiency: float
     operator_efficiency: float
-    applied_combinations: List[str]
-    applied_rules: List[OperatorEfficiency]
-    control_center_requirements: List[RoomRequirement]
-    dormitory_requirements: List[RoomRequirement]
-    power_station_requirements: List[RoomRequirement]
-    hire_requirements: List[RoomRequirement]
-    processing_station_requirements: List[RoomRequirement]  # [新增] 加工站需求结果
-    assignment_detail: List[Dict] = field(default_factory=list)  # [新增] 详细分配信息
+    applied_combinations: Tuple[str, ...]
+    applied_rule_ids: Tuple[int, ...]  # 规则以 rule_id 引用，见 WorkplaceOptimizer.get_rule
+    control_center_requirements: Tuple[RoomRequirement, ...]
+    dormitory_requirements: Tuple[RoomRequirement, ...]
+    power_station_requirements: Tuple[RoomRequirement, ...]
+    hire_requirements: Tuple[RoomRequirement, ...]
+    processing_station_requirements: Tuple[RoomRequirement, ...]  # [新增] 加工站需求结果
+    assignment_detail: Tuple[Dict, ...] = ()  # [新增] 详细分配信息 {'rule_id', 'ops', 'eff', 'type'}
 
 
 @dataclass
@@ -78,56 +93,353 @@ class ControlCenterRule:
     elite_requirements: Dict[str, int] = field(default_factory=dict)
 
 
-# ----------------- 优化器类定义 -----------------
-
-class WorkplaceOptimizer:
-    def __init__(self, efficiency_file: str, operator_file: str, config_file: str = None, debug: bool = False):
-        self.efficiency_file = efficiency_file
-        self.operator_file = operator_file
-        self.config_file = config_file
-        self.debug = debug
-
-        self.efficiency_data = self.load_json(efficiency_file)
-        self.operator_data = self.load_json(operator_file)
-        self.config_data = self.load_json(config_file) if config_file else {}
-
-        self.trading_stations_count = self.config_data.get('trading_stations_count', 3)
-        self.manufacturing_stations_count = self.config_data.get('manufacturing_stations_count', 3)
-
-        self.operators = self.load_operators()
+# ----------------- 干员数据覆盖层 -----------------
+
+class RosterOverlay:
+    """
+    写时复制的干员数据：只读的基础数据（operators.json 的内容）+ 少量精英化覆盖。
+    可以直接作为 WorkplaceOptimizer 的 operator_data 使用，迭代时只为被覆盖的干员生成新记录；
+    应用练度建议、假设分析（what-if）都不需要复制整份干员数据。
+    """
+
+    def __init__(self, base: List[Dict], overrides: Optional[Dict[str, int]] = None, _index=None):
+        self.base = base  # 不会被修改
+        if _index is None:
+            _index = ({str(op['id']): i for i, op in enumerate(base) if op.get('id')},
+                      {op['name']: i for i, op in enumerate(base) if op.get('name')})
+        self._by_id, self._by_name = _index
+        self.overrides = dict(overrides or {})  # 干员名 -> 精英化等级
+
+    def find(self, op_id: Optional[str] = None, name: Optional[str] = None) -> Optional[Dict]:
+        """按 ID（优先）或名字查找干员，返回应用覆盖后的记录"""
+        i = self._by_id.get(str(op_id)) if op_id else None
+        if i is None and name:
+            i = self._by_name.get(name)
+        return None if i is None else self._record(self.base[i])
+
+    def with_elite(self, op_id: Optional[str], name: Optional[str],
+                   target_elite: int) -> Tuple['RosterOverlay', Optional[str]]:
+        """
+        返回把该干员精英化改为 target_elite 的新覆盖层（共享基础数据和索引），以及匹配到的干员名；
+        找不到干员时返回自身和 None
+        """
+        op = self.find(op_id, name)
+        if op is None:
+            return self, None
+        overrides = dict(self.overrides)
+        overrides[op['name']] = int(target_elite)
+        return RosterOverlay(self.base, overrides, (self._by_id, self._by_name)), op['name']
+
+    def _record(self, op: Dict) -> Dict:
+        elite = self.overrides.get(op.get('name'))
+        if elite is None:
+            return op
+        return {**op, 'elite': elite, 'level': 1}  # 练度修改后等级默认重置为 1
+
+    def __iter__(self):
+        if not self.overrides:
+            return iter(self.base)
+        return (self._record(op) for op in self.base)
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    def to_list(self) -> List[Dict]:
+        """展开为普通列表（保存到文件时使用）"""
+        return list(self)
+
+
+# ----------------- 规则库定义 -----------------
+
+def _read_json(file_path: str) -> Any:
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"Warning: File {file_path} not found.")
+        return {}
+
+
+# ----------------- 规则校验 -----------------
+
+# 规则中引用干员的字段（"干员名" 或 "干员名/精英等级"）
+OPERATOR_REF_KEYS = ('combo', 'control_center', 'dormitory', 'power_station', 'hire', 'process')
+RULE_KEYS = set(OPERATOR_REF_KEYS) | {'efficiency', 'priority', 'product', 'apply_each', 'when', 'scale', '//', 'note'}
+SYSTEM_KEYS = {'base_combo', 'rules', 'product', 'base_efficiency', 'when', '//', 'note'}
+CC_RULE_KEYS = {'operator', 'operators', 'description', 'efficiency', 'priority', 'group', 'apply_each', '//', 'note'}
+# combination_rules 的工作站类型 -> workplaces 中对应的配置
+WORKPLACE_SECTIONS = {'trading_station': 'trading_stations', 'manufacturing_station': 'manufacturing_stations',
+                      'meeting_room': 'meeting_room', 'power_station': 'power_station'}
+
+
+def _parse_operator_ref(op_str: Any) -> Optional[Tuple[str, int]]:
+    """解析 "干员名/精英等级"，格式错误时返回 None"""
+    if not isinstance(op_str, str):
+        return None
+    name, sep, elite = op_str.partition('/')
+    name = name.strip()
+    if not name:
+        return None
+    if not sep:
+        return name, 0
+    elite = elite.strip()
+    if elite not in ('0', '1', '2'):
+        return None
+    return name, int(elite)
+
+
+# 规则的声明式条件（"when"，体系上的条件对其中每条规则生效），加载时编译成闭包：
+#   "free":      ["黑键/2", ...]  这些干员本班仍可上岗（持有、练度足够、未被占用、未满班）
+#   "in_shift":  ["迷迭香", ...]  这些干员本班已经在岗（先计算的房间里已经安排）
+#   "elite_max": {"孑": 0}        干员的精英等级不高于给定值（忽略练度时不检查）
+PREDICATE_KEYS = ('free', 'in_shift', 'elite_max')
+# 按布局缩放效率（"scale"）：效率 = Σ 系数 × 对应房间数，如清流 {"trading_stations_count": 20}
+SCALE_KEYS = ('trading_stations_count', 'manufacturing_stations_count', 'power_stations_count')
+
+
+def _predicate_error(spec: Any) -> Optional[str]:
+    """检查 "when" 的格式，返回错误信息（格式正确时为 None）"""
+    if not isinstance(spec, dict):
+        return "when 应为对象"
+    for kind, value in spec.items():
+        if kind not in PREDICATE_KEYS:
+            return f"when 中未知的条件 {kind}（可用: {', '.join(PREDICATE_KEYS)}）"
+        if kind == 'elite_max':
+            if not isinstance(value, dict) or not all(
+                    isinstance(name, str) and type(elite) is int and 0 <= elite <= 2 for name, elite in value.items()):
+                return "when.elite_max 应为 {干员名: 0-2}"
+        elif not isinstance(value, list) or not value or any(_parse_operator_ref(ref) is None for ref in value):
+            return f"when.{kind} 应为 \"干员名\" 或 \"干员名/0-2\" 的非空列表"
+    return None
+
+
+def _scale_error(spec: Any) -> Optional[str]:
+    """检查 "scale" 的格式，返回错误信息（格式正确时为 None）"""
+    if not isinstance(spec, dict) or not spec:
+        return "scale 应为非空对象"
+    for key, per in spec.items():
+        if key not in SCALE_KEYS:
+            return f"scale 中未知的字段 {key}（可用: {', '.join(SCALE_KEYS)}）"
+        if not isinstance(per, (int, float)) or isinstance(per, bool):
+            return f"scale.{key} 应为数值"
+    return None
+
+
+def _parse_predicates(*specs: Optional[Dict[str, Any]]) -> Tuple[Tuple[str, Tuple[Tuple[str, int], ...]], ...]:
+    """把一个或多个 "when" 合并成规范化的元组（可哈希、可随规则库缓存）；格式已由校验保证"""
+    parsed = []
+    for spec in specs:
+        for kind in PREDICATE_KEYS:
+            if spec and kind in spec:
+                if kind == 'elite_max':
+                    args = tuple(sorted(spec[kind].items()))
+                else:
+                    args = tuple(_parse_operator_ref(ref) for ref in spec[kind])
+                parsed.append((kind, args))
+    return tuple(parsed)
+
+
+def _issue(level: str, code: str, where: str, message: str) -> Dict[str, str]:
+    return {'level': level, 'code': code, 'where': where, 'message': message}
+
+
+def validate_efficiency_data(efficiency_data: Dict[str, Any]) -> Tuple[List[Dict[str, str]], set]:
+    """
+    检查 efficiency.json 原始数据的格式。
+    :return: (问题列表, 应跳过的条目位置集合)
+        位置：(工作站类型, 体系名, 规则下标)，体系本身有错时下标为 None；控制中枢规则为 ('control_center_rules', 下标)
+    """
+    issues = []
+    bad = set()
+
+    def check_refs(refs, where, key):
+        ok = True
+        if isinstance(refs, str) and key != 'combo':
+            refs = [refs]
+        if not isinstance(refs, list):
+            issues.append(_issue('error', 'malformed', where, f"{key} 应为列表"))
+            return False
+        for ref in refs:
+            if _parse_operator_ref(ref) is None:
+                issues.append(_issue('error', 'malformed', where, f"{key} 中的 {ref!r} 不是 \"干员名\" 或 \"干员名/0-2\""))
+                ok = False
+        return ok
+
+    def check_rule(rule_data, where, require_combo):
+        if not isinstance(rule_data, dict):
+            issues.append(_issue('error', 'malformed', where, "规则应为对象"))
+            return False
+        ok = True
+        if not isinstance(rule_data.get('efficiency'), (int, float)) or isinstance(rule_data.get('efficiency'), bool):
+            issues.append(_issue('error', 'malformed', where, "缺少数值类型的 efficiency"))
+            ok = False
+        if require_combo and not rule_data.get('combo'):
+            issues.append(_issue('error', 'malformed', where, "缺少 combo"))
+            ok = False
+        for key in OPERATOR_REF_KEYS:
+            if key in rule_data and not check_refs(rule_data[key], where, key):
+                ok = False
+        for key, check in (('when', _predicate_error), ('scale', _scale_error)):
+            message = check(rule_data[key]) if key in rule_data else None
+            if message:
+                issues.append(_issue('error', 'malformed', where, message))
+                ok = False
+        for key in rule_data:
+            if key not in RULE_KEYS:
+                hint = "（应为 power_station？）" if key == 'power' else ""
+                issues.append(_issue('warning', 'unknown_key', where, f"未知字段 {key}，不会生效{hint}"))
+        return ok
+
+    for workplace_type, systems in efficiency_data.get('combination_rules', {}).items():
+        if workplace_type not in WORKPLACE_SECTIONS:
+            issues.append(_issue('warning', 'unknown_workplace', f"combination_rules.{workplace_type}",
+                                 "未知的工作站类型，其中的规则不会被使用"))
+        for system_name, system_data in systems.items():
+            where = f"combination_rules.{workplace_type}.{system_name}"
+            if isinstance(system_data, list):
+                for i, rule_data in enumerate(system_data):
+                    if not check_rule(rule_data, f"{where}[{i}]", True):
+                        bad.add((workplace_type, system_name, i))
+            elif isinstance(system_data, dict):
+                for key in system_data:
+                    if key not in SYSTEM_KEYS:
+                        issues.append(_issue('warning', 'unknown_key', where, f"未知字段 {key}，不会生效"))
+                if 'base_combo' in system_data and not check_refs(system_data['base_combo'], where, 'base_combo'):
+                    bad.add((workplace_type, system_name, None))
+                if 'when' in system_data and _predicate_error(system_data['when']):
+                    issues.append(_issue('error', 'malformed', where, _predicate_error(system_data['when'])))
+                    bad.add((workplace_type, system_name, None))
+                for i, rule_data in enumerate(system_data.get('rules', [])):
+                    if not check_rule(rule_data, f"{where}.rules[{i}]", not system_data.get('base_combo')):
+                        bad.add((workplace_type, system_name, i))
+            else:
+                issues.append(_issue('error', 'malformed', where, "体系应为规则列表或对象"))
+                bad.add((workplace_type, system_name, None))
+
+    for i, rule_data in enumerate(efficiency_data.get('control_center_rules', [])):
+        where = f"control_center_rules[{i}]"
+        if not isinstance(rule_data, dict):
+            issues.append(_issue('error', 'malformed', where, "规则应为对象"))
+            bad.add(('control_center_rules', i))
+            continue
+        refs = rule_data.get('operators', rule_data.get('operator'))
+        ok = refs is not None and check_refs([refs] if isinstance(refs, str) else refs, where, 'operator')
+        if refs is None:
+            issues.append(_issue('error', 'malformed', where, "缺少 operator"))
+        if not isinstance(rule_data.get('efficiency', 0), (int, float)):
+            issues.append(_issue('error', 'malformed', where, "efficiency 应为数值"))
+            ok = False
+        for key in rule_data:
+            if key not in CC_RULE_KEYS:
+                issues.append(_issue('warning', 'unknown_key', where, f"未知字段 {key}，不会生效"))
+        if not ok:
+            bad.add(('control_center_rules', i))
+    return issues, bad
+
+
+def load_operator_catalog(pattern: str = os.path.join("user_data", "*", "operators.json")) -> set:
+    """已知干员名目录：所有客户 operators.json 中出现过的干员名的并集"""
+    import glob
+    names = set()
+    for path in glob.glob(pattern):
+        names.update(op['name'] for op in _read_json(path) if op.get('name'))
+    return names
+
+
+# 规则库二进制缓存：文件名包含 efficiency.json 的内容哈希；规则库结构变化时提升版本号使旧缓存失效
+RULEBOOK_CACHE_VERSION = 4
+WARM_START_FORMAT = 2  # 热启动存档格式，AssignmentResult 等结构变化时递增
+RULEBOOK_CACHE_DIR = ".rulebook_cache"
+
+
+class RuleBook:
+    """
+    展开后的 efficiency.json 规则库。
+    只读，可以在多个 WorkplaceOptimizer 实例（以及进程池的 worker）之间共享，避免重复解析。
+    """
+
+    def __init__(self, efficiency_data: Dict[str, Any], source: str = "", digest: Optional[str] = None):
+        self.source = source
+        self.digest = digest  # efficiency.json 内容的 sha256
+        self.efficiency_data = efficiency_data
+        # 格式错误的条目在展开时跳过，问题列表可通过 validate() / compile_rules.py 查看
+        self.load_issues, self._bad_entries = validate_efficiency_data(efficiency_data)
+        errors = sum(1 for issue in self.load_issues if issue['level'] == 'error')
+        if errors:
+            print(f"Warning: 规则文件 {source} 中有 {errors} 处格式错误，相关规则已跳过（运行 compile_rules.py 查看）")
         self.efficiency_rules = self.load_efficiency_rules()
         self.cc_rules = self.load_cc_rules()
+        self.cc_rules_by_operator, self.cc_rule_unlocks = self.index_cc_rules()
+        self.pruned_rule_ids, self.rule_dominators = self.analyze_dominance()
 
-        # 动态调整清流效率
-        for rule in self.efficiency_rules:
-            if rule.workplace_type == 'manufacturing_station' and rule.operators == ['清流']:
-                rule.synergy_efficiency = self.trading_stations_count * 20
-                break
-
-        self.workplaces = self.load_workplaces()
-        self.fiammetta_targets = []
-
-    def load_json(self, file_path: str) -> Any:
+    @classmethod
+    def from_file(cls, efficiency_file: str, use_cache: bool = True) -> 'RuleBook':
+        """
+        读取规则库。优先加载与文件内容哈希匹配的二进制缓存，
+        缓存不存在、版本或哈希不符、损坏时完整解析，并重新写入缓存。
+        """
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(efficiency_file, 'rb') as f:
+                raw = f.read()
         except FileNotFoundError:
-            print(f"Warning: File {file_path} not found.")
-            return {}
-
-    def load_operators(self) -> Dict[str, Operator]:
-        operators = {}
-        for op_data in self.operator_data:
-            operators[op_data['name']] = Operator(
-                id=op_data['id'],
-                name=op_data['name'],
-                elite=op_data['elite'],
-                level=op_data['level'],
-                own=op_data['own'],
-                potential=op_data['potential'],
-                rarity=op_data['rarity']
-            )
-        return operators
+            return cls(_read_json(efficiency_file), source=efficiency_file)
+
+        digest = hashlib.sha256(raw).hexdigest()
+        cache_file = cls.cache_path(efficiency_file, digest)
+        if use_cache:
+            rulebook = cls._load_cache(cache_file, digest)
+            if rulebook is not None:
+                rulebook.source = efficiency_file
+                return rulebook
+
+        rulebook = cls(json.loads(raw.decode('utf-8')), source=efficiency_file, digest=digest)
+        if use_cache:
+            rulebook._save_cache(cache_file)
+        return rulebook
+
+    @staticmethod
+    def cache_path(efficiency_file: str, digest: str) -> str:
+        directory = os.path.join(os.path.dirname(os.path.abspath(efficiency_file)), RULEBOOK_CACHE_DIR)
+        name = os.path.splitext(os.path.basename(efficiency_file))[0]
+        return os.path.join(directory, f"{name}.{digest[:16]}.v{RULEBOOK_CACHE_VERSION}.pickle")
+
+    @classmethod
+    def _load_cache(cls, cache_file: str, digest: str) -> Optional['RuleBook']:
+        try:
+            with open(cache_file, 'rb') as f:
+                version, cached_digest, rulebook = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Warning: 规则库缓存 {cache_file} 无法读取，重新解析: {e}")
+            return None
+        if version != RULEBOOK_CACHE_VERSION or cached_digest != digest or not isinstance(rulebook, cls):
+            return None
+        return rulebook
+
+    def save(self, path: str):
+        """把编译后的规则库写到 path（与缓存格式相同）；先写临时文件再替换，避免并发读到写了一半的文件"""
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((RULEBOOK_CACHE_VERSION, self.digest, self), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, path)
+
+    def _save_cache(self, cache_file: str):
+        try:
+            self.save(cache_file)
+            # 清理同一规则文件的旧版本缓存（只在规则库缓存目录内清理，不动其他位置的文件）
+            directory, current = os.path.split(cache_file)
+            if os.path.basename(directory) != RULEBOOK_CACHE_DIR:
+                return
+            prefix = current.split('.', 1)[0] + '.'
+            for old in os.listdir(directory):
+                if old != current and old.startswith(prefix) and old.endswith('.pickle'):
+                    os.remove(os.path.join(directory, old))
+        except OSError as e:
+            print(f"Warning: 规则库缓存写入失败: {e}")
 
     def load_efficiency_rules(self) -> List[OperatorEfficiency]:
         expanded_rules: List[OperatorEfficiency] = []
@@ -142,8 +454,12 @@ class WorkplaceOptimizer:
         expanded_rules = []
         for workplace_type, systems in self.efficiency_data.get('combination_rules', {}).items():
             for system_name, system_data in systems.items():
+                if (workplace_type, system_name, None) in self._bad_entries:
+                    continue
                 if isinstance(system_data, list):
-                    for rule_data in system_data:
+                    for i, rule_data in enumerate(system_data):
+                        if (workplace_type, system_name, i) in self._bad_entries:
+                            continue
                         operators = []
                         elite_requirements = {}
                         for op_str in rule_data['combo']:
@@ -158,7 +474,7 @@ class WorkplaceOptimizer:
                                 for s in rule_data[key]:
                                     n, e = parse_operator_string(s)
                                     reqs.append(RoomRequirement(operator=n, elite_required=e))
-                            return reqs
+                            return tuple(reqs)
 
                         products = rule_data.get('product', [])
                         if isinstance(products, str): products = [products]
@@ -178,7 +494,9 @@ class WorkplaceOptimizer:
                             requires_processing_station=parse_reqs('process'),
                             apply_each=rule_data.get('apply_each', False),
                             priority=rule_data.get('priority', 0),
-                            products=products
+                            products=products,
+                            when=_parse_predicates(rule_data.get('when')),
+                            scale=tuple(rule_data.get('scale', {}).items())
                         ))
                 elif isinstance(system_data, dict):
                     # 处理复杂体系
@@ -193,7 +511,9 @@ class WorkplaceOptimizer:
                             base_operators.append(name)
                             if elite > 0: base_elite_requirements[name] = elite
 
-                    for rule_data in system_data.get('rules', []):
+                    for i, rule_data in enumerate(system_data.get('rules', [])):
+                        if (workplace_type, system_name, i) in self._bad_entries:
+                            continue
                         all_ops = base_operators.copy()
                         all_elites = base_elite_requirements.copy()
                         for op_str in rule_data.get('combo', []):
@@ -207,7 +527,7 @@ class WorkplaceOptimizer:
                                 for s in rule_data[key]:
                                     n, e = parse_operator_string(s)
                                     reqs.append(RoomRequirement(operator=n, elite_required=e))
-                            return reqs
+                            return tuple(reqs)
 
                         p = rule_data.get('product', base_products)
                         if isinstance(p, str):
@@ -229,17 +549,21 @@ class WorkplaceOptimizer:
                             requires_processing_station=parse_reqs_rule('process'),
                             apply_each=rule_data.get('apply_each', False),
                             priority=rule_data.get('priority', 0),
-                            products=p
+                            products=p,
+                            when=_parse_predicates(system_data.get('when'), rule_data.get('when')),
+                            scale=tuple(rule_data.get('scale', {}).items())
                         ))
 
         expanded_rules.sort(key=lambda r: (r.priority, r.synergy_efficiency), reverse=True)
-        return expanded_rules
+        return [replace(rule, rule_id=i) for i, rule in enumerate(expanded_rules)]
 
     def load_cc_rules(self) -> List[ControlCenterRule]:
         rules = []
         raw_rules = self.efficiency_data.get('control_center_rules', [])
 
-        for r in raw_rules:
+        for index, r in enumerate(raw_rules):
+            if ('control_center_rules', index) in self._bad_entries:
+                continue
             # 1. 获取干员列表，兼容 'operators' 和 'operator' 两种写法
             raw_ops = r.get('operators', r.get('operator', []))
             if isinstance(raw_ops, str):
@@ -299,6 +623,489 @@ class WorkplaceOptimizer:
         rules.sort(key=lambda x: (x.priority, x.efficiency), reverse=True)
         return rules
 
+    @staticmethod
+    def _rule_gate(rule: OperatorEfficiency) -> str:
+        """补位时的互斥门禁类别：自动化 / 含清流（中立）/ 通用"""
+        if "自动化" in rule.description:
+            return 'auto'
+        return 'pure' if "清流" in rule.operators else 'generic'
+
+    @staticmethod
+    def _requirements_covered(weaker: Tuple[RoomRequirement, ...], stronger: Tuple[RoomRequirement, ...]) -> bool:
+        """weaker 中的每条附属房间需求，stronger 中都有同一干员、精英化要求不低的需求"""
+        need = {}
+        for req in stronger:
+            need[req.operator] = max(need.get(req.operator, 0), req.elite_required)
+        return all(req.operator in need and need[req.operator] >= req.elite_required for req in weaker)
+
+    def analyze_dominance(self) -> Tuple[frozenset, Dict[int, Tuple[int, ...]]]:
+        """
+        被支配规则分析（用于补位循环剪枝）。规则 d 支配规则 r：
+        同一工作站类型，都不是按人拆分的规则，d 排在 r 前面（同效率时补位循环取先出现的规则），
+        d 的干员是 r 的子集，且 d 的人均效率不低于 r。此时只要本轮 d 可行，r 就不可能被选中。
+        若 d 的精英化要求、附属房间需求都不高于 r，产物限制不窄于 r，门禁类别兼容，
+        则 r 可行时 d 必然可行，r 可以直接从候选中删除（静态剪枝）；否则在补位时发现 d 可行后跳过 r。
+        d 带 when 条件时 r 可行不能推出 d 可行，只做动态跳过。
+        会客室效率与干员练度有关、带 scale 的规则效率随布局调整，这些规则不参与分析。
+        :return: (静态删除的 rule_id 集合, rule_id -> 支配它的 rule_id 列表)
+        """
+        def eligible(rule):
+            if rule.apply_each or rule.workplace_type == 'meeting_room':
+                return False
+            return not rule.scale
+
+        pruned = set()
+        dominators = {}
+        rules = [r for r in self.efficiency_rules if eligible(r)]
+        for r in rules:
+            r_ops = set(r.operators)
+            r_eff = r.synergy_efficiency / len(r.operators)
+            found = []
+            for d in rules:
+                if d.rule_id >= r.rule_id:
+                    break
+                if d.workplace_type != r.workplace_type or d.rule_id in pruned:
+                    continue
+                if not set(d.operators) <= r_ops or d.synergy_efficiency / len(d.operators) < r_eff:
+                    continue
+                static = (
+                        not d.when and
+                        (not d.products or (r.products and set(r.products) <= set(d.products))) and
+                        self._rule_gate(d) in ('pure', self._rule_gate(r)) and
+                        all(d.elite_requirements.get(n, 0) <= r.elite_requirements.get(n, 0) for n in d.operators) and
+                        all(self._requirements_covered(getattr(d, key), getattr(r, key)) for key in (
+                            'requires_control_center', 'requires_dormitory', 'requires_power_station', 'requires_hire'))
+                )
+                if static:
+                    pruned.add(r.rule_id)
+                    break
+                found.append(d.rule_id)
+            if r.rule_id not in pruned and found:
+                dominators[r.rule_id] = tuple(found)
+        return frozenset(pruned), dominators
+
+    def validate(self, known_operators: Optional[set] = None) -> List[Dict[str, str]]:
+        """
+        完整校验：原始格式问题 + 展开后规则的问题
+        （未知干员、放不下/产物不符/重复干员导致永远不可达、重复与冲突的规则、被支配的规则）
+        :param known_operators: 已知干员名目录（如 load_operator_catalog()），不传则不检查干员名
+        """
+        issues = list(self.load_issues)
+        workplaces = self.efficiency_data.get('workplaces', {})
+
+        def room_info(workplace_type):
+            section = workplaces.get(WORKPLACE_SECTIONS.get(workplace_type, ''), {})
+            template = section[0] if isinstance(section, list) and section else section
+            if not isinstance(template, dict):
+                return None, None
+            return template.get('max_operators'), template.get('products')
+
+        seen = {}
+        for rule in self.efficiency_rules:
+            where = f"{rule.workplace_type} / {rule.description}"
+            max_operators, room_products = room_info(rule.workplace_type)
+            if not rule.apply_each and max_operators is not None and len(rule.operators) > max_operators:
+                issues.append(_issue('warning', 'unreachable', where,
+                                     f"需要 {len(rule.operators)} 人，超过房间容量 {max_operators}"))
+            if len(set(rule.operators)) != len(rule.operators):
+                issues.append(_issue('warning', 'unreachable', where, "同一干员在规则中出现多次"))
+            if room_products and rule.products and not set(rule.products) & set(room_products):
+                issues.append(_issue('warning', 'unreachable', where, f"产物 {rule.products} 不能在该房间生产"))
+            if known_operators is not None:
+                refs = list(rule.operators) + [req.operator for reqs in (
+                    rule.requires_control_center, rule.requires_dormitory, rule.requires_power_station,
+                    rule.requires_hire, rule.requires_processing_station) for req in reqs] + [
+                    name for _, args in rule.when for name, _ in args]
+                unknown = [name for name in dict.fromkeys(refs) if name not in known_operators]
+                if unknown:
+                    issues.append(_issue('warning', 'unknown_operator', where, f"未知干员: {', '.join(unknown)}"))
+            if rule.rule_id in self.pruned_rule_ids:
+                issues.append(_issue('info', 'dominated', where, "被更优规则支配，计算时不会被选中"))
+
+            key = (rule.workplace_type, tuple(sorted(rule.operators)), tuple(sorted(rule.elite_requirements.items())),
+                   rule.requires_control_center, rule.requires_dormitory, rule.requires_power_station,
+                   rule.requires_hire, rule.requires_processing_station, tuple(rule.products), rule.apply_each,
+                   rule.when)
+            previous = seen.setdefault(key, rule)
+            if previous is not rule:
+                if (previous.synergy_efficiency, previous.priority) == (rule.synergy_efficiency, rule.priority):
+                    issues.append(_issue('warning', 'duplicate', where, "与另一条规则完全相同"))
+                elif previous.priority == rule.priority:
+                    issues.append(_issue('warning', 'conflict', where,
+                                         f"条件相同但效率不同（{previous.synergy_efficiency} / {rule.synergy_efficiency}）"))
+
+        cc_seen = set()
+        for rule in self.cc_rules:
+            where = f"control_center / {rule.description}"
+            if known_operators is not None:
+                unknown = [name for name in rule.operators if name not in known_operators]
+                if unknown:
+                    issues.append(_issue('warning', 'unknown_operator', where, f"未知干员: {', '.join(unknown)}"))
+            key = (tuple(sorted(rule.operators)), tuple(sorted(rule.elite_requirements.items())), rule.group,
+                   rule.efficiency, rule.priority)
+            if key in cc_seen:
+                issues.append(_issue('warning', 'duplicate', where, "与另一条中枢规则完全相同"))
+            cc_seen.add(key)
+        return issues
+
+    @property
+    def version(self) -> str:
+        """规则库版本：规则文件内容哈希的前 12 位"""
+        return self.digest[:12] if self.digest else "unknown"
+
+    def dominance_report(self) -> Dict[str, Dict[str, int]]:
+        """各工作站类型被静态删除 / 运行时可跳过的规则数量"""
+        report = {}
+        for rule in self.efficiency_rules:
+            entry = report.setdefault(rule.workplace_type, {'rules': 0, 'pruned': 0, 'dominated': 0})
+            entry['rules'] += 1
+            if rule.rule_id in self.pruned_rule_ids:
+                entry['pruned'] += 1
+            elif rule.rule_id in self.rule_dominators:
+                entry['dominated'] += 1
+        return report
+
+    def index_cc_rules(self) -> Tuple[Dict[str, List[int]], List[int]]:
+        """
+        控制中枢规则索引：
+        - 干员名 -> 包含该干员的中枢规则下标
+        - 每条中枢规则“解锁”的贸易站/制造站规则数（规则的 control_center 需求里出现了该规则的干员）
+        """
+        by_operator: Dict[str, List[int]] = {}
+        for i, rule in enumerate(self.cc_rules):
+            for name in rule.operators:
+                by_operator.setdefault(name, []).append(i)
+
+        required_by: Dict[str, int] = {}
+        for rule in self.efficiency_rules:
+            if rule.workplace_type in ('trading_station', 'manufacturing_station'):
+                for name in {req.operator for req in rule.requires_control_center}:
+                    required_by[name] = required_by.get(name, 0) + 1
+        unlocks = [sum(required_by.get(name, 0) for name in rule.operators) for rule in self.cc_rules]
+        return by_operator, unlocks
+
+
+class RulebookRegistry:
+    """
+    规则库注册表：监视规则文件，文件变化后在后台线程编译新版本，成功后原子替换当前版本。
+    已经开始的计算持有旧 RuleBook 对象（只读、不会被修改），会在旧版本上完成；
+    新的计算通过 current() 取到最新版本。编译失败时保留旧版本。
+    """
+
+    def __init__(self, efficiency_file: str = "efficiency.json", poll_interval: float = 2.0):
+        self.efficiency_file = efficiency_file
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._compiling = False
+        self._last_check = time.monotonic()
+        self._stamp = self._file_stamp()
+        self._current = RuleBook.from_file(efficiency_file)
+        self._watcher = None
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.efficiency_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @property
+    def version(self) -> str:
+        return self._current.version
+
+    def current(self) -> RuleBook:
+        """当前版本的规则库；顺便（按轮询间隔）检查文件是否变化"""
+        if time.monotonic() - self._last_check >= self.poll_interval:
+            self.check()
+        return self._current
+
+    def check(self, wait: bool = False) -> bool:
+        """文件有变化时启动后台编译，返回是否启动了编译；wait=True 时等待编译完成"""
+        self._last_check = time.monotonic()
+        stamp = self._file_stamp()
+        with self._lock:
+            if stamp is None or stamp == self._stamp or self._compiling:
+                return False
+            self._compiling = True
+        worker = threading.Thread(target=self._compile, args=(stamp,), daemon=True)
+        worker.start()
+        if wait:
+            worker.join()
+        return True
+
+    def _compile(self, stamp: Tuple[int, int]):
+        try:
+            rulebook = RuleBook.from_file(self.efficiency_file)
+            if not rulebook.efficiency_data:
+                raise ValueError("规则文件为空")
+        except Exception as e:
+            print(f"Warning: 规则文件 {self.efficiency_file} 编译失败，继续使用版本 {self.version}: {e}")
+            rulebook = None
+        with self._lock:
+            self._stamp = stamp
+            self._compiling = False
+            if rulebook is not None and rulebook.digest != self._current.digest:
+                print(f"[rules] 规则库已更新: {self._current.version} -> {rulebook.version}")
+                self._current = rulebook
+
+    def start(self) -> 'RulebookRegistry':
+        """启动后台监视线程（守护线程，随进程退出）"""
+        if self._watcher is None:
+            def watch():
+                while True:
+                    time.sleep(self.poll_interval)
+                    self.check()
+
+            self._watcher = threading.Thread(target=watch, name="rulebook-watcher", daemon=True)
+            self._watcher.start()
+        return self
+
+
+# ----------------- 向量化评分引擎 -----------------
+
+class VectorizedRuleScorer:
+    """
+    用 NumPy 一次性评估房间内所有候选规则（engine="numpy"）。
+    每个 (房间类型, 产物) 把规则编译成矩阵：
+    - A  : 候选 × 干员 的关联矩阵（apply_each 规则按人展开成多行）
+    - E  : 候选对自身干员的精英化要求
+    - R/RE: 附属房间（中枢/宿舍/发电站/办公室）需求的关联矩阵与精英化要求
+    每次选人只需按当前可用状态构造几个干员向量，一次矩阵运算得到所有候选的可行性与每人效率，再取 argmax。
+    行顺序与逐条评估时的遍历顺序一致，argmax 取第一个最大值，因此结果与 Python 引擎相同。
+    """
+
+    def __init__(self, optimizer: 'WorkplaceOptimizer'):
+        import numpy as np
+        self.np = np
+        self.optimizer = optimizer
+        self._tables = {}
+        self._owned = (None, None, None)  # ((排除的干员, 本班不可上岗的干员), 持有向量, 附属房间可用向量)
+
+        names = []
+        for rule in optimizer.efficiency_rules:
+            names.extend(rule.operators)
+            for reqs in (rule.requires_control_center, rule.requires_dormitory,
+                         rule.requires_power_station, rule.requires_hire):
+                names.extend(req.operator for req in reqs)
+        self.names = list(dict.fromkeys(names))
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.load_roster()
+
+    def load_roster(self):
+        """干员数据变化后刷新干员向量；规则矩阵与干员无关，继续复用"""
+        np = self.np
+        ops = self.optimizer.operators
+        self.elite = np.array([ops[n].elite if n in ops else 0 for n in self.names], dtype=np.int64)
+        # 会客室动态加成（当前练度）：基础 5%，精一 +8%，精二 +16%
+        self.meeting_bonus = 5 + np.where(self.elite == 2, 16, np.where(self.elite == 1, 8, 0)).astype(np.float64)
+        self._owned = (None, None, None)
+
+    def _table(self, workplace_type: str, product: str) -> Dict[str, Any]:
+        key = (workplace_type, product)
+        if key in self._tables:
+            return self._tables[key]
+
+        np = self.np
+        rows = []
+        for rule in self.optimizer.candidate_rules(workplace_type, product, roster_only=False):
+            if rule.apply_each:
+                rows.extend((rule, [name], 'each') for name in rule.operators)
+            else:
+                rows.append((rule, rule.operators, 'norm'))
+
+        n, m = len(rows), len(self.names)
+        A = np.zeros((n, m), dtype=np.float64)
+        E = np.zeros((n, m), dtype=np.int64)
+        R = np.zeros((n, m), dtype=np.float64)
+        RE = np.zeros((n, m), dtype=np.int64)
+        for i, (rule, req, _) in enumerate(rows):
+            for name in req:
+                A[i, self.index[name]] = 1
+                E[i, self.index[name]] = rule.elite_requirements.get(name, 0)
+            for reqs in (rule.requires_control_center, rule.requires_dormitory,
+                         rule.requires_power_station, rule.requires_hire):
+                for r in reqs:
+                    j = self.index[r.operator]
+                    R[i, j] = 1
+                    RE[i, j] = max(RE[i, j], r.elite_required)
+
+        is_auto = np.array(["自动化" in rule.description for rule, _, _ in rows], dtype=bool)
+        has_pure = np.array(["清流" in rule.operators for rule, _, _ in rows], dtype=bool)
+        table = {
+            'rows': rows, 'A': A, 'E': E, 'R': R, 'RE': RE,
+            'size': A.sum(axis=1),
+            'eff': np.array([rule.synergy_efficiency for rule, _, _ in rows], dtype=np.float64),
+            'is_auto': is_auto,
+            'is_generic': ~is_auto & ~has_pure,
+            'elite_needed': (E > 0).any(axis=1) | (RE > 0).any(axis=1),
+            'checks': [(i, rule.rule_id) for i, (rule, _, _) in enumerate(rows) if rule.when],
+        }
+        self._tables[key] = table
+        return table
+
+    def best_candidate(self, workplace_type: str, product: str, operator_usage: Dict[str, int],
+                       busy_names: set, remaining_slots: int, ignore_elite: bool,
+                       room_has_automation: bool, room_has_generic: bool) -> Optional[Dict[str, Any]]:
+        t = self._table(workplace_type, product)
+        if not t['rows']:
+            return None
+        np = self.np
+        opt = self.optimizer
+
+        key = (frozenset(opt.excluded_operators), opt._shift_unavailable)
+        if self._owned[0] != key:
+            excluded, unavailable = key
+            owned = np.array([n in opt.operators and opt.operators[n].own and n not in excluded
+                              for n in self.names], dtype=bool)
+            # 本班不可上岗的干员也不能满足附属房间需求（与 check_room_requirements 一致）
+            self._owned = (key, owned, owned & np.array([n not in unavailable for n in self.names], dtype=bool))
+        owned, supporters = self._owned[1], self._owned[2]
+        usage = np.array([operator_usage.get(n, 0) for n in self.names], dtype=np.int64)
+        busy = np.array([n in busy_names for n in self.names], dtype=bool)
+        fiammetta = workplace_type == 'trading_station'
+        max_usage = np.array([3 if fiammetta and n in opt.fiammetta_targets else 2 for n in self.names])
+
+        available = owned & ~busy & (usage < max_usage)
+        support_ok = supporters & (usage < 2)  # 附属房间干员不检查本班次占用，只检查是否可用和疲劳
+
+        feasible = (t['A'] @ ~available == 0) & (t['R'] @ ~support_ok == 0) & (t['size'] <= remaining_slots)
+        if not ignore_elite:
+            feasible &= ~(t['E'] > self.elite).any(axis=1) & ~(t['RE'] > self.elite).any(axis=1)
+        if room_has_automation:
+            feasible &= ~t['is_generic']
+        if room_has_generic:
+            feasible &= ~t['is_auto']
+        for i, rule_id in t['checks']:
+            if feasible[i] and not opt._rule_checks[rule_id](operator_usage, busy_names, ignore_elite):
+                feasible[i] = False
+
+        real_eff = t['eff'] + (t['A'] @ self.meeting_bonus if workplace_type == 'meeting_room' else 0)
+        scores = np.where(feasible, real_eff / t['size'], -np.inf)
+        best = int(np.argmax(scores))
+        if not scores[best] > -1:
+            return None
+
+        rule, req, row_type = t['rows'][best]
+        return {'rule': rule, 'req': req, 'eff': float(real_eff[best]), 'slots': len(req), 'type': row_type}
+
+
+def _meeting_bonus(elite: int) -> int:
+    """会客室单名干员的动态加成：基础 5%，精一 +8%，精二 +16%"""
+    return 5 + (16 if elite == 2 else 8 if elite == 1 else 0)
+
+
+# ----------------- 优化器类定义 -----------------
+
+class WorkplaceOptimizer:
+    def __init__(self, efficiency_file: str, operator_file: str, config_file: str = None, debug: bool = False,
+                 rulebook: Optional[RuleBook] = None, operator_data: Optional[List[Dict]] = None,
+                 config_data: Optional[Dict[str, Any]] = None, engine: Optional[str] = None):
+        """
+        :param rulebook: 预先展开的规则库。传入后不再读取 efficiency_file，多个实例/进程可共享同一份
+        :param operator_data: 直接传入干员数据（operators.json 的内容或 RosterOverlay），传入后不再读取 operator_file
+        :param config_data: 直接传入配置（config.json 的内容），传入后不再读取 config_file
+        :param engine: 候选规则评分引擎，"python"（默认）或 "numpy"（向量化，需安装 numpy）；不指定时读取配置 engine
+        """
+        self.rulebook = rulebook if rulebook is not None else RuleBook.from_file(efficiency_file)
+        self.efficiency_file = efficiency_file or self.rulebook.source
+        self.operator_file = operator_file
+        self.config_file = config_file
+        self.debug = debug
+
+        self.efficiency_data = self.rulebook.efficiency_data
+        self.operator_data = operator_data if operator_data is not None else self.load_json(operator_file)
+        if config_data is not None:
+            self.config_data = config_data
+        else:
+            self.config_data = self.load_json(config_file) if config_file else {}
+
+        self.trading_stations_count = self.config_data.get('trading_stations_count', 3)
+        self.manufacturing_stations_count = self.config_data.get('manufacturing_stations_count', 3)
+        self.power_stations_count = self.config_data.get(
+            'power_stations_count', len(self.efficiency_data['workplaces']['power_station']))
+
+        self.operators = self.load_operators()
+        self.build_roster_view()
+        self.efficiency_rules = self.load_efficiency_rules()
+        self.cc_rules = self.load_cc_rules()
+
+        # 按布局缩放效率的规则，如清流 20% × 贸易站数（规则对象由规则库共享，替换而不是原地修改）
+        for i, rule in enumerate(self.efficiency_rules):
+            if rule.scale:
+                self.efficiency_rules[i] = replace(
+                    rule, synergy_efficiency=sum(per * getattr(self, key) for key, per in rule.scale))
+        self._rule_checks = self.compile_rule_predicates()
+
+        self.workplaces = self.load_workplaces()
+        self.fiammetta_targets = []
+        self.build_meeting_bonus_table()
+        self._candidate_rules = {}
+        if self.debug:
+            for workplace_type, entry in self.rulebook.dominance_report().items():
+                print(f"[rules] {workplace_type}: {entry['rules']} 条，删除被支配 {entry['pruned']} 条，"
+                      f"可跳过 {entry['dominated']} 条")
+
+        self.engine = engine or self.config_data.get('engine', 'python')
+        self.scorer = None
+        if self.engine == 'numpy':
+            try:
+                self.scorer = VectorizedRuleScorer(self)
+            except ImportError:
+                print("Warning: numpy 未安装，回退到 python 评分引擎。")
+                self.engine = 'python'
+
+        self.excluded_operators = set()  # 本次计算中视为不可用的干员（备选方案、客户不能用的干员）
+        self._shift_unavailable = frozenset()  # 当前班次不可上岗的干员
+        self._fiammetta_memo = {}  # 模拟模式下各目标组合的评估结果
+
+        # 单房间优化结果缓存：可用性签名 -> 分配结果（有界 LRU，每次分析开始时清空）
+        self._room_cache = OrderedDict()
+        self._room_cache_names = {}  # 工作站类型 -> 影响该类房间结果的干员名（签名只看这些干员）
+        self._run_depth = 0
+        self.room_cache_stats = {'hits': 0, 'misses': 0, 'warm': 0}
+        # 热启动存档：上次存档中仍然有效的房间结果（enable_warm_start / load_warm_start 后启用）
+        self._warm_rooms: Optional[OrderedDict] = None
+        self._plan_rooms: List[Tuple[Tuple, AssignmentResult]] = []  # 当前方案各房间的 (可用性签名, 结果)
+
+    def load_json(self, file_path: str) -> Any:
+        return _read_json(file_path)
+
+    def load_operators(self) -> Dict[str, Operator]:
+        operators = {}
+        for op_data in self.operator_data:
+            operators[op_data['name']] = Operator(
+                id=op_data['id'],
+                name=op_data['name'],
+                elite=op_data['elite'],
+                level=op_data['level'],
+                own=op_data['own'],
+                potential=op_data['potential'],
+                rarity=op_data['rarity']
+            )
+        return operators
+
+    def load_roster(self, operator_data: List[Dict]):
+        """更换干员数据，复用其余已编译的状态（规则、工作站、评分矩阵），用于批量评估"""
+        previous = self._owned_by_name
+        self.operator_data = operator_data
+        self.operators = self.load_operators()
+        self.build_roster_view()
+        self._fiammetta_memo = {}
+        self._room_cache.clear()
+        if self._warm_rooms is not None:
+            self._invalidate_warm_rooms(previous)
+        self._candidate_rules = {}
+        self.build_meeting_bonus_table()
+        if self.scorer is not None:
+            self.scorer.load_roster()
+
+    def load_efficiency_rules(self) -> List[OperatorEfficiency]:
+        # 规则列表由规则库共享，这里复制一份，避免本实例的调整（如清流）影响其他实例
+        return list(self.rulebook.efficiency_rules)
+
+    def load_cc_rules(self) -> List[ControlCenterRule]:
+        return list(self.rulebook.cc_rules)
+
     def load_workplaces(self) -> Dict[str, List[Workplace]]:
         # 保持原有的 load_workplaces 逻辑
         workplaces = {
@@ -327,15 +1134,120 @@ class WorkplaceOptimizer:
                 Workplace(id=m_data['id'], name=m_data['name'], max_operators=m_data['max_operators'],
                           base_efficiency=m_data['base_efficiency']))
 
-        for ps_data in self.efficiency_data['workplaces']['power_station']:
+        power_templates = self.efficiency_data['workplaces']['power_station']
+        for i in range(self.power_stations_count):
+            if i < len(power_templates):
+                ps_data = power_templates[i]
+            else:
+                # 布局中的发电站多于模板时，按第一个模板补齐
+                ps_data = dict(power_templates[0], id=f"power_{i + 1}", name=f"发电站{i + 1}")
             workplaces['power_station'].append(
                 Workplace(id=ps_data['id'], name=ps_data['name'], max_operators=ps_data['max_operators'],
                           base_efficiency=ps_data['base_efficiency']))
 
         return workplaces
 
-    def get_available_operators(self) -> List[Operator]:
-        return [op for op in self.operators.values() if op.own]
+    def candidate_rules(self, workplace_type: str, product: str, roster_only: bool = True) -> List[OperatorEfficiency]:
+        """
+        补位循环的候选规则（按规则顺序，已去掉被静态支配的规则），按 (类型, 产物) 缓存。
+        :param roster_only: 同时去掉当前干员数据下永远不可行的规则（涉及未拥有的干员）
+        """
+        key = (workplace_type, product, roster_only)
+        rules = self._candidate_rules.get(key)
+        if rules is None:
+            pruned = self.rulebook.pruned_rule_ids
+            rules = [r for r in self.efficiency_rules
+                     if r.workplace_type == workplace_type and (not r.products or product in r.products)
+                     and r.rule_id not in pruned and (not roster_only or self._rule_possible(r))]
+            self._candidate_rules[key] = rules
+        return rules
+
+    def _rule_possible(self, rule: OperatorEfficiency) -> bool:
+        owned = self._owned_by_name
+        if rule.apply_each:
+            if not any(name in owned for name in rule.operators):
+                return False
+        elif not all(name in owned for name in rule.operators):
+            return False
+        return all(req.operator in owned for reqs in (
+            rule.requires_control_center, rule.requires_dormitory, rule.requires_power_station, rule.requires_hire)
+                   for req in reqs) and all(name in owned for kind, args in rule.when if kind != 'elite_max'
+                                            for name, _ in args)
+
+    def compile_rule_predicates(self) -> Dict[int, Any]:
+        """
+        把规则的 when 条件编译成闭包：rule_id -> check(operator_usage, shift_used_names, ignore_elite) -> bool。
+        只有带条件的规则有条目，补位循环里其余规则只多一次 rule.when 的真值判断。
+        """
+        checks = {}
+        for rule in self.efficiency_rules:
+            if rule.when:
+                predicates = [self._compile_predicate(kind, args) for kind, args in rule.when]
+                checks[rule.rule_id] = predicates[0] if len(predicates) == 1 else \
+                    (lambda usage, busy, ignore_elite, _ps=tuple(predicates): all(p(usage, busy, ignore_elite)
+                                                                                  for p in _ps))
+        return checks
+
+    def _compile_predicate(self, kind: str, args: Tuple[Tuple[str, int], ...]):
+        if kind == 'free':
+            def check(operator_usage, shift_used_names, ignore_elite):
+                op_by_name = self.get_available_index()
+                for name, elite in args:
+                    op = op_by_name.get(name)
+                    if op is None or name in shift_used_names or \
+                            operator_usage.get(name, 0) >= (3 if name in self.fiammetta_targets else 2):
+                        return False
+                    if not ignore_elite and op.elite < elite:
+                        return False
+                return True
+        elif kind == 'in_shift':
+            names = tuple(name for name, _ in args)
+
+            def check(operator_usage, shift_used_names, ignore_elite):
+                return all(name in shift_used_names for name in names)
+        elif kind == 'elite_max':
+            def check(operator_usage, shift_used_names, ignore_elite):
+                if ignore_elite:
+                    return True
+                op_by_name = self.get_available_index()
+                return all(name in op_by_name and op_by_name[name].elite <= elite for name, elite in args)
+        else:
+            raise ValueError(f"未知的规则条件: {kind}")
+        return check
+
+    def get_rule(self, rule_id: int) -> OperatorEfficiency:
+        """按 rule_id 取规则（本实例的规则列表与规则库顺序一致，清流等调整后的版本）"""
+        return self.efficiency_rules[rule_id]
+
+    def build_roster_view(self):
+        """构建已拥有干员的只读视图及名字/ID 索引，只在干员数据变化时重建"""
+        owned = tuple(op for op in self.operators.values() if op.own)
+        self._owned_view = owned
+        self._owned_by_name = MappingProxyType({op.name: op for op in owned})
+        self._owned_by_id = MappingProxyType({op.id: op for op in owned})
+        self._available_view = (frozenset(), owned, self._owned_by_name)
+
+    def _available_view_for_exclusions(self) -> Tuple[frozenset, Tuple[Operator, ...], Mapping[str, Operator]]:
+        excluded, ops, by_name = self._available_view
+        if excluded != self.excluded_operators:
+            # 排除集合变化时才重新过滤（同一次计算内排除集合不变）
+            excluded = frozenset(self.excluded_operators)
+            ops = tuple(op for op in self._owned_view if op.name not in excluded)
+            by_name = MappingProxyType({op.name: op for op in ops})
+            self._available_view = (excluded, ops, by_name)
+        return self._available_view
+
+    def get_available_operators(self) -> Tuple[Operator, ...]:
+        """当前可用干员（已拥有且未被排除），只读"""
+        return self._available_view_for_exclusions()[1]
+
+    def get_available_index(self) -> Mapping[str, Operator]:
+        """当前可用干员的名字索引，只读"""
+        return self._available_view_for_exclusions()[2]
+
+    def get_operator_by_id(self, op_id: str) -> Optional[Operator]:
+        """按干员 ID 查找已拥有的干员"""
+        return self._owned_by_id.get(op_id)
 
     # --------------- 核心修改：增加 ignore_elite 参数 ---------------
 
@@ -360,7 +1272,7 @@ class WorkplaceOptimizer:
             if req.operator not in self.operators:
                 return False
             op = self.operators[req.operator]
-            if not op.own:
+            if not op.own or req.operator in self.excluded_operators or req.operator in self._shift_unavailable:
                 return False
             if not ignore_elite and op.elite < req.elite_required:
                 return False
@@ -378,7 +1290,7 @@ class WorkplaceOptimizer:
         if '菲亚梅塔' not in self.operators:
             return False
         op = self.operators['菲亚梅塔']
-        if not op.own:
+        if not op.own or op.name in self.excluded_operators:
             return False
         # 如果忽略等级限制，只要拥有即可；否则需要精二
         return True if ignore_elite else op.elite >= 2
@@ -395,39 +1307,247 @@ class WorkplaceOptimizer:
         else:
             return workplace.id.split('_')[0] + '_station'
 
+    def synergy_upper_bound(self, room_types: List[Tuple[str, str]], total_slots: int,
+                            ignore_elite: bool = False, max_shifts: int = 3) -> float:
+        """
+        若干房间在全部班次中协同效率之和的上界。
+        任何方案的协同效率都可以拆成每个上班干员分到的“规则效率 / 人数”，
+        这一份额不超过该干员在可行规则中的最大平均效率，且每名干员全天最多上 max_shifts 个班（菲亚梅塔目标为 3）。
+        :param room_types: 参与计算的 (workplace_type, product) 列表
+        :param total_slots: 这些房间所有班次的干员位置总数
+        """
+        op_value = {}
+        for rule in self.efficiency_rules:
+            if rule.synergy_efficiency <= 0:
+                continue
+            if not any(rule.workplace_type == wt and (not rule.products or product in rule.products)
+                       for wt, product in room_types):
+                continue
+            ops = [self.operators.get(n) for n in rule.operators]
+            if rule.apply_each:
+                for op in ops:
+                    if op and op.own and (ignore_elite or op.elite >= rule.elite_requirements.get(op.name, 0)):
+                        op_value[op.name] = max(op_value.get(op.name, 0), rule.synergy_efficiency)
+            elif all(op and op.own for op in ops) and \
+                    self.check_elite_requirements(ops, rule.elite_requirements, ignore_elite):
+                per_slot = rule.synergy_efficiency / len(ops)
+                for op in ops:
+                    op_value[op.name] = max(op_value.get(op.name, 0), per_slot)
+
+        bound = 0.0
+        for value in sorted(op_value.values(), reverse=True):
+            if total_slots <= 0:
+                break
+            take = min(max_shifts, total_slots)
+            bound += value * take
+            total_slots -= take
+        return bound
+
+    def build_meeting_bonus_table(self):
+        """
+        预计算会客室动态加成（随干员数据变化重建）：
+        _meeting_op_bonus[(rule_id, 干员)] = (当前练度加成, 按规则要求补足练度后的加成)
+        _meeting_rule_bonus[rule_id] = 规则全部干员的加成合计（同上两项）
+        """
+        self._meeting_op_bonus = {}
+        self._meeting_rule_bonus = {}
+        for rule in self.efficiency_rules:
+            if rule.workplace_type != 'meeting_room':
+                continue
+            totals = [0, 0]
+            for name in rule.operators:
+                op = self.operators.get(name)
+                if op is None:
+                    totals = None
+                    continue
+                # 潜在方案 (ignore_elite=True) 中，当前等级低于要求时按要求的等级计算
+                req_elite = rule.elite_requirements.get(name, 0)
+                bonus = (_meeting_bonus(op.elite), _meeting_bonus(max(op.elite, req_elite)))
+                self._meeting_op_bonus[(rule.rule_id, name)] = bonus
+                if totals is not None:
+                    totals[0] += bonus[0]
+                    totals[1] += bonus[1]
+            if totals is not None:
+                self._meeting_rule_bonus[rule.rule_id] = tuple(totals)
+
     def calculate_dynamic_efficiency(self, rule, op_objs, workplace_type, ignore_elite=False):
-        """计算动态效率，包含会客室的特殊加成"""
-        base_eff = rule.synergy_efficiency
-        if workplace_type == 'meeting_room':
-            bonus = 0
-            for op in op_objs:
-                # 基础加成 5%
-                bonus += 5
-
-                # 确定计算用的精英化等级
-                calc_elite = op.elite
-
-                # 如果是潜在方案计算 (ignore_elite=True)，且当前等级不满足需求，
-                # 我们应该使用规则要求的等级来计算潜在收益
-                if ignore_elite:
-                    req_elite = rule.elite_requirements.get(op.name, 0)
-                    # 如果当前等级低于要求，使用要求的等级计算
-                    if op.elite < req_elite:
-                        calc_elite = req_elite
-
-                # 精英化加成
-                if calc_elite == 2:
-                    bonus += 16
-                elif calc_elite == 1:
-                    bonus += 8
-            return base_eff + bonus
-        return base_eff
+        """计算动态效率，包含会客室的特殊加成（查预计算的加成表）"""
+        if workplace_type != 'meeting_room':
+            return rule.synergy_efficiency
+        column = 1 if ignore_elite else 0
+        if not rule.apply_each and len(op_objs) == len(rule.operators):
+            return rule.synergy_efficiency + self._meeting_rule_bonus[rule.rule_id][column]
+        return rule.synergy_efficiency + sum(self._meeting_op_bonus[(rule.rule_id, op.name)][column] for op in op_objs)
+
+    ROOM_CACHE_SIZE = 4096
+    WARM_START_ROOMS = 512  # 热启动存档最多保存的房间结果数（与内存中的 LRU 分开计数）
+
+    def _begin_run(self):
+        """进入一次分析；最外层进入时清空房间缓存（嵌套的模拟、k-best 子问题共享同一份缓存）"""
+        if self._run_depth == 0:
+            self._room_cache.clear()
+            self.room_cache_stats = {'hits': 0, 'misses': 0, 'warm': 0}
+        self._run_depth += 1
+
+    def _end_run(self):
+        self._run_depth -= 1
+
+    def _relevant_names(self, workplace_type: str) -> Tuple[str, ...]:
+        """该类工作站的结果只取决于这些干员的状态：规则干员、规则的房间需求干员、条件中的干员以及清流"""
+        names = self._room_cache_names.get(workplace_type)
+        if names is None:
+            found = {'清流'}
+            for rule in self.efficiency_rules:
+                if rule.workplace_type != workplace_type:
+                    continue
+                found.update(rule.operators)
+                for reqs in (rule.requires_control_center, rule.requires_dormitory, rule.requires_power_station,
+                             rule.requires_hire, rule.requires_processing_station):
+                    found.update(req.operator for req in reqs)
+                found.update(name for _, args in rule.when for name, _ in args)
+            names = tuple(sorted(found))
+            self._room_cache_names[workplace_type] = names
+        return names
+
+    def _room_cache_key(self, workplace: Workplace, workplace_type: str, operator_usage: Dict[str, int],
+                        shift_used_names: set, ignore_elite: bool) -> Tuple:
+        """可用性签名：本班占用位图、排除（含本班不可上岗）位图、菲亚梅塔目标位图和各干员已上班次数"""
+        busy = excluded = targets = 0
+        for i, name in enumerate(self._relevant_names(workplace_type)):
+            bit = 1 << i
+            if name in shift_used_names:
+                busy |= bit
+            if name in self.excluded_operators or name in self._shift_unavailable:
+                excluded |= bit
+            if name in self.fiammetta_targets:
+                targets |= bit
+        fatigue = bytes(min(operator_usage.get(name, 0), 255) for name in self._relevant_names(workplace_type))
+        return (workplace_type, workplace.current_product, workplace.max_operators, ignore_elite,
+                busy, excluded, targets, fatigue)
 
     def optimize_workplace(self, workplace: Workplace, operator_usage: Dict[str, int],
                            shift_used_names: set, ignore_elite: bool = False) -> AssignmentResult:
+        """优化单个工作站的干员配置；相同可用性签名的房间直接复用缓存结果"""
+        workplace_type = self.get_workplace_type(workplace)
+        key = self._room_cache_key(workplace, workplace_type, operator_usage, shift_used_names, ignore_elite)
+        cached = self._room_cache.get(key)
+        if cached is None and self._warm_rooms is not None:
+            # 热启动：上次分析中同一可用性签名下的房间结果
+            cached = self._warm_rooms.get(key)
+            if cached is not None:
+                self.room_cache_stats['warm'] += 1
+                self._room_cache[key] = cached
+        if cached is None:
+            self.room_cache_stats['misses'] += 1
+            cached = self._solve_workplace(workplace, operator_usage, shift_used_names, ignore_elite)
+            self._room_cache[key] = cached
+            if len(self._room_cache) > self.ROOM_CACHE_SIZE:
+                self._room_cache.popitem(last=False)
+            self._plan_rooms.append((key, cached))
+            return cached
+
+        self.room_cache_stats['hits'] += 1
+        self._room_cache.move_to_end(key)
+        self._plan_rooms.append((key, cached))
+        # 重放求解时对班次状态的修改
+        for op in cached.optimal_operators:
+            shift_used_names.add(op.name)
+            operator_usage[op.name] += 1
+        return replace(cached, workplace=workplace,
+                       total_efficiency=workplace.base_efficiency + cached.operator_efficiency)
+
+    def enable_warm_start(self):
+        """启用热启动：之后的分析会先查存档中的房间结果"""
+        if self._warm_rooms is None:
+            self._warm_rooms = OrderedDict()
+
+    def _efficiency_config_digest(self) -> str:
+        """影响规则效率的配置（布局中各类房间数，scale 规则按它们缩放）的摘要，配置变了热启动存档就作废"""
+        inputs = json.dumps([self.trading_stations_count, self.manufacturing_stations_count,
+                             self.power_stations_count], separators=(',', ':'))
+        return hashlib.sha256(inputs.encode('utf-8')).hexdigest()[:16]
+
+    def warm_start_state(self, *results: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        热启动存档：规则库版本、效率相关配置的摘要、已拥有干员的快照和各可用性签名下的房间结果。
+        房间结果只取传入方案（get_optimal_assignments 的结果）实际用到的房间，再补上载入的存档中仍有效的部分，
+        最多 WARM_START_ROOMS 条；top-K、灵敏度等探索性求解的房间不会挤掉最终方案的房间。
+        """
+        rooms = OrderedDict()
+        for res in results:
+            for key, room in res.get("warm_rooms", ()):
+                rooms.setdefault(key, room)
+        for key, room in reversed((self._warm_rooms or {}).items()):
+            if len(rooms) >= self.WARM_START_ROOMS:
+                break
+            rooms.setdefault(key, room)
+        return {
+            "format": WARM_START_FORMAT,
+            "rulebook_version": self.rulebook.version,
+            "config_digest": self._efficiency_config_digest(),
+            "operators": dict(self._owned_by_name),
+            "rooms": list(rooms.items())[:self.WARM_START_ROOMS],
+        }
+
+    def save_warm_start(self, path: str, *results: Dict[str, Any]):
+        """
+        把热启动存档写到 path（先写临时文件再替换；同一进程内多个会话可能同时写，临时文件名带线程号）
+        :param results: 本次采用的方案，存档保存它们用到的房间结果（见 warm_start_state）
+        """
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self.warm_start_state(*results), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: 热启动存档写入失败 {path}: {e}")
+
+    def load_warm_start(self, state: Any) -> Dict[str, Any]:
+        """
+        载入上次分析的存档（dict 或文件路径）作为热启动。
+        先比对干员快照：影响某类工作站的干员（见 _relevant_names）都没有变化时，该类房间的存档结果保留，
+        本次分析中可用性签名相同的房间直接沿用；其余房间照常求解，结果与完整求解一致。
+        存档不存在、损坏，或规则库版本、布局配置不同时不使用存档（完整求解）。
+        :return: {"kept": 保留的房间结果数, "dropped": 丢弃数, "changed": 变化的干员名}
+        """
+        self.enable_warm_start()
+        if isinstance(state, str):
+            if not os.path.exists(state):
+                return {"kept": 0, "dropped": 0, "changed": []}
+            try:
+                with open(state, 'rb') as f:
+                    state = pickle.load(f)
+            except Exception as e:
+                print(f"Warning: 热启动存档无法读取，完整求解 {state}: {e}")
+                return {"kept": 0, "dropped": 0, "changed": []}
+        if not isinstance(state, dict) or state.get("format") != WARM_START_FORMAT \
+                or state.get("rulebook_version") != self.rulebook.version \
+                or state.get("config_digest") != self._efficiency_config_digest():
+            return {"kept": 0, "dropped": len(state.get("rooms", ())) if isinstance(state, dict) else 0,
+                    "changed": []}
+
+        for key, result in state["rooms"]:
+            self._warm_rooms[key] = result
+        dropped, changed = self._invalidate_warm_rooms(state["operators"])
+        return {"kept": len(self._warm_rooms), "dropped": dropped, "changed": sorted(changed)}
+
+    def _invalidate_warm_rooms(self, previous: Mapping[str, Operator]) -> Tuple[int, set]:
+        """干员数据变化后，丢弃受变化干员影响的工作站类型的存档结果；返回 (丢弃数, 变化的干员名)"""
+        current = self._owned_by_name
+        changed = {name for name in previous.keys() | current.keys() if previous.get(name) != current.get(name)}
+        if not changed:
+            return 0, changed
+        stale_types = {key[0] for key in self._warm_rooms}
+        stale_types = {t for t in stale_types if not changed.isdisjoint(self._relevant_names(t))}
+        stale = [key for key in self._warm_rooms if key[0] in stale_types]
+        for key in stale:
+            del self._warm_rooms[key]
+        return len(stale), changed
+
+    def _solve_workplace(self, workplace: Workplace, operator_usage: Dict[str, int],
+                         shift_used_names: set, ignore_elite: bool = False) -> AssignmentResult:
         """优化单个工作站的干员配置，增加 ignore_elite 参数"""
-        available_ops = self.get_available_operators()
-        op_by_name = {op.name: op for op in available_ops}
+        op_by_name = self.get_available_index()
         workplace_type = self.get_workplace_type(workplace)
 
         def rule_matches_products(rule: OperatorEfficiency) -> bool:
@@ -499,113 +1619,7 @@ class WorkplaceOptimizer:
 
             return base_eff
 
-            # ----------------- 1. 评估体系 -----------------
-            for system_name, rules in system_groups.items():
-                if system_name == "通用": continue
-                for rule in rules:
-                    if remaining_slots <= 0: break
-
-                    required = rule.operators
-
-                    # 1. 检查干员是否可用、是否占用、是否满班
-                    unavailable_ops = []
-                    for op_name in required:
-                        max_usage = 3 if op_name in self.fiammetta_targets and workplace_type == 'trading_station' else 2
-                        if (
-                                op_name not in op_by_name or
-                                op_name in used_names or
-                                op_name in shift_used_names or
-                                operator_usage.get(op_name, 0) >= max_usage
-                        ):
-                            unavailable_ops.append(op_name)
-
-                    if unavailable_ops or len(required) > remaining_slots:
-                        continue
-
-                    # =========================================================================
-                    # === [修改开始] 特殊依赖检查：制造站迷迭香体系的前置检查 ===
-                    # =========================================================================
-                    # 只有当规则是制造站的迷迭香，且效率极高（>200，代表满配体系）时触发
-                    if workplace_type == 'manufacturing_station' and "迷迭香" in required and rule.synergy_efficiency > 200:
-                        # 必须保证 黑键 和 乌有 在接下来的贸易站计算中是“可用”的
-                        # 如果他们不可用，这个迷迭香的高效规则就不能成立
-                        partners_check = [("黑键", 2), ("乌有", 2)]
-                        partners_ok = True
-
-                        for p_name, p_elite in partners_check:
-                            # A. 检查是否有这个干员
-                            if p_name not in op_by_name:
-                                partners_ok = False;
-                                break
-
-                            # B. 检查是否已经被本班次其他房间（比如还没轮到的贸易站? 不可能，因为制造站先算）
-                            # 这里主要是防止他们被错误地排进了当前制造站的其他位置（虽然不太可能）
-                            # 或者在未来的逻辑修改中顺序变动
-                            if p_name in shift_used_names or p_name in used_names:
-                                partners_ok = False;
-                                break
-
-                            # C. 检查疲劳度 (是否还能上班)
-                            # 黑键/乌有通常是2班倒，除非被菲亚梅塔选中
-                            p_max_usage = 3 if p_name in self.fiammetta_targets else 2
-                            if operator_usage.get(p_name, 0) >= p_max_usage:
-                                partners_ok = False;
-                                break
-
-                            # D. 检查练度 (如果不忽略练度)
-                            if not ignore_elite:
-                                p_op = op_by_name[p_name]
-                                if p_op.elite < p_elite:
-                                    partners_ok = False;
-                                    break
-
-                        if not partners_ok:
-                            continue  # 如果黑键或乌有不可用，跳过这条迷迭香的规则，去匹配低效率的通用规则
-                    # =========================================================================
-                    # === [修改结束] ===
-                    # =========================================================================
-
-                # 2. 特殊依赖检查：黑键/乌有 需要 迷迭香
-                if workplace_type == 'trading_station' and ('黑键' in required or '乌有' in required):
-                    # 检查当前班次是否已经使用了 迷迭香
-                    if '迷迭香' not in shift_used_names:
-                        continue
-
-                        # 3. 现在可以安全地生成对象列表了（因为已经确认所有人都有了）
-                op_objs = [op_by_name[op_name] for op_name in required]
-
-                # 4. 检查精英化等级
-                if not ignore_elite:
-                    if "孑0体系" in rule.description:
-                        if not any(op.name == "孑" and op.elite == 0 for op in op_objs if op.name == "孑"): continue
-                    elif "孑12体系" in rule.description:
-                        if not any(
-                                op.name == "孑" and op.elite in [1, 2] for op in op_objs if op.name == "孑"): continue
-
-                if not self.check_elite_requirements(op_objs, rule.elite_requirements, ignore_elite): continue
-
-                # 5. 检查房间需求
-                if not self.check_room_requirements(rule.requires_control_center, operator_usage,
-                                                    ignore_elite): continue
-                if not self.check_room_requirements(rule.requires_dormitory, operator_usage, ignore_elite): continue
-                if not self.check_room_requirements(rule.requires_power_station, operator_usage, ignore_elite): continue
-                if not self.check_room_requirements(rule.requires_hire, operator_usage, ignore_elite): continue
-
-                # [新增] 检查加工站需求
-                if hasattr(rule, 'requires_processing_station') and rule.requires_processing_station:
-                    if not self.check_room_requirements(rule.requires_processing_station, operator_usage,
-                                                        ignore_elite): continue
-
-                # === 计算效率 ===
-                real_eff = self.calculate_dynamic_efficiency(rule, op_objs, workplace_type, ignore_elite)
-                efficiency_per_slot = calculate_adjusted_efficiency(rule, required, remaining_slots, real_eff)
-
-                if efficiency_per_slot > best_efficiency:
-                    best_efficiency = efficiency_per_slot
-                    best_candidate = {'type': 'system', 'rule': rule, 'required': required,
-                                      'efficiency': real_eff, 'slots_used': len(required)}
-
-        # ----------------- 2. 评估通用 -----------------
+        # ----------------- 评估通用 -----------------
         generic_rules = system_groups.get("通用", [])
         for rule in generic_rules:
             # ... (这部分的逻辑通常不需要改，因为通用干员不排斥其他人) ...
@@ -627,6 +1641,8 @@ class WorkplaceOptimizer:
                     if (not self.check_room_requirements(rule.requires_control_center, operator_usage, ignore_elite) or
                             not self.check_room_requirements(rule.requires_dormitory, operator_usage,
                                                              ignore_elite)): continue
+                    if rule.when and not self._rule_checks[rule.rule_id](operator_usage, shift_used_names,
+                                                                          ignore_elite): continue
 
                     real_eff = self.calculate_dynamic_efficiency(rule, [op_obj], workplace_type, ignore_elite)
                     eff = real_eff
@@ -649,6 +1665,8 @@ class WorkplaceOptimizer:
                         not self.check_room_requirements(rule.requires_power_station, operator_usage, ignore_elite) or
                         not self.check_room_requirements(rule.requires_hire, operator_usage, ignore_elite)):
                     continue
+                if rule.when and not self._rule_checks[rule.rule_id](operator_usage, shift_used_names, ignore_elite):
+                    continue
 
                 # === 修改点：通用组也用一下这个函数比较保险，虽然通常没影响 ===
                 real_eff = self.calculate_dynamic_efficiency(rule, op_objs, workplace_type, ignore_elite)
@@ -684,7 +1702,8 @@ class WorkplaceOptimizer:
 
             # [新增] 记录详细分配信息，用于练度计算归因
             assignment_detail = [
-                {'rule': rule, 'ops': required, 'eff': best_candidate['efficiency'], 'type': best_candidate['type']}]
+                {'rule_id': rule.rule_id, 'ops': required, 'eff': best_candidate['efficiency'],
+                 'type': best_candidate['type']}]
         else:
             assignment_detail = []
 
@@ -705,23 +1724,22 @@ class WorkplaceOptimizer:
 
         return AssignmentResult(
             workplace=workplace,
-            optimal_operators=assigned_ops,
+            optimal_operators=tuple(assigned_ops),
             total_efficiency=workplace.base_efficiency + total_synergy,
             operator_efficiency=total_synergy,
-            applied_combinations=applied_combinations,
-            applied_rules=applied_rules,
-            control_center_requirements=applied_reqs['control'],
-            dormitory_requirements=applied_reqs['dorm'],
-            power_station_requirements=applied_reqs['power'],
-            hire_requirements=applied_reqs['hire'],
-            processing_station_requirements=applied_reqs['process'],
-            assignment_detail=assignment_detail  # [新增]
+            applied_combinations=tuple(applied_combinations),
+            applied_rule_ids=tuple(rule.rule_id for rule in applied_rules),
+            control_center_requirements=tuple(applied_reqs['control']),
+            dormitory_requirements=tuple(applied_reqs['dorm']),
+            power_station_requirements=tuple(applied_reqs['power']),
+            hire_requirements=tuple(applied_reqs['hire']),
+            processing_station_requirements=tuple(applied_reqs['process']),
+            assignment_detail=tuple(assignment_detail)  # [新增]
         )
 
     def optimize_workplace_recursive(self, workplace, operator_usage, shift_used_names, assigned_ops, used_names,
                                      remaining_slots, applied_combinations, ignore_elite, applied_rules_list):
-        available_ops = self.get_available_operators()
-        op_by_name = {op.name: op for op in available_ops}
+        op_by_name = self.get_available_index()
         workplace_type = self.get_workplace_type(workplace)
 
         local_synergy = 0
@@ -749,18 +1767,27 @@ class WorkplaceOptimizer:
         # 如果逻辑正常，room_has_automation 和 room_has_generic 不应同时为 True
         # 但如果发生了，优先视作自动化房（因为通用效率已被清空）
 
-        def rule_matches_products(rule):
-            if not rule.products: return True
-            return workplace.current_product in rule.products
+        dominators = self.rulebook.rule_dominators
+        checks = self._rule_checks
 
         while remaining_slots > 0:
             best_cand = None
             best_eff = -1
+            feasible_ids = set()  # 本轮已确认可行的规则，用于跳过被它们支配的规则
 
-            all_rules = [r for r in self.efficiency_rules if
-                         r.workplace_type == workplace_type and rule_matches_products(r)]
+            if self.scorer is not None:
+                all_rules = []  # 向量化引擎一次评估全部候选
+                best_cand = self.scorer.best_candidate(
+                    workplace_type, workplace.current_product, operator_usage, used_names | shift_used_names,
+                    remaining_slots, ignore_elite, room_has_automation, room_has_generic)
+            else:
+                all_rules = self.candidate_rules(workplace_type, workplace.current_product)
 
             for rule in all_rules:
+                dominated_by = dominators.get(rule.rule_id)
+                if dominated_by and not feasible_ids.isdisjoint(dominated_by):
+                    continue
+
                 # --- 严格的互斥逻辑 (Gate Keeper) ---
 
                 rule_is_auto = "自动化" in rule.description
@@ -797,6 +1824,8 @@ class WorkplaceOptimizer:
                                                                  ignore_elite) or
                                 not self.check_room_requirements(rule.requires_hire, operator_usage,
                                                                  ignore_elite)): continue
+                        if rule.when and not checks[rule.rule_id](operator_usage, shift_used_names, ignore_elite):
+                            continue
 
                         real_eff = self.calculate_dynamic_efficiency(rule, [op_obj], workplace_type)
                         if real_eff > best_eff:
@@ -820,7 +1849,10 @@ class WorkplaceOptimizer:
                                                              ignore_elite) or
                             not self.check_room_requirements(rule.requires_hire, operator_usage,
                                                              ignore_elite)): continue
+                    if rule.when and not checks[rule.rule_id](operator_usage, shift_used_names, ignore_elite):
+                        continue
 
+                    feasible_ids.add(rule.rule_id)
                     real_eff = self.calculate_dynamic_efficiency(rule, op_objs, workplace_type)
                     eff_per = real_eff / len(req)
                     if eff_per > best_eff:
@@ -853,7 +1885,8 @@ class WorkplaceOptimizer:
                 local_reqs['power'].extend(rule.requires_power_station)
                 local_reqs['hire'].extend(rule.requires_hire)
 
-                local_details.append({'rule': rule, 'ops': req, 'eff': best_cand['eff'], 'type': best_cand['type']})
+                local_details.append({'rule_id': rule.rule_id, 'ops': req, 'eff': best_cand['eff'],
+                                      'type': best_cand['type']})
             else:
                 break
 
@@ -864,79 +1897,89 @@ class WorkplaceOptimizer:
 
     def fill_control_center(self, plan: Dict, shift_used_names: set, operator_usage: Dict, ignore_elite: bool):
         """
-        填充控制中枢剩余位置，处理互斥逻辑，并增加班次限制
+        填充控制中枢剩余位置，处理互斥逻辑，并增加班次限制。
+        剩余位置按带互斥组约束的小背包精确求解（分支定界），
+        目标按 (效率之和, 优先级之和, 解锁的贸易/制造规则数) 字典序取最大。
         """
         current_cc_ops = plan["rooms"]["control"][0]["operators"]
         remaining_slots = 5 - len(current_cc_ops)
         if remaining_slots <= 0:
             return
 
-        # 1. 标记已占用的互斥组 (Group)
+        # 1. 标记已占用的互斥组 (Group)：如果当前中枢里有互斥组的人，那个组就算被用了
+        by_operator = self.rulebook.cc_rules_by_operator
         used_groups = set()
         for op_name in current_cc_ops:
-            for rule in self.cc_rules:
-                if op_name in rule.operators and rule.group:
-                    # 简单策略：如果某人已经在里面了，且这个人是某条规则的成员，则尝试锁定组
-                    # (为了更严谨，这里假设如果当前中枢里有互斥组的人，那个组就算被用了)
-                    used_groups.add(rule.group)
+            for i in by_operator.get(op_name, ()):
+                if self.cc_rules[i].group:
+                    used_groups.add(self.cc_rules[i].group)
 
-        available_ops = self.get_available_operators()
-        op_by_name = {op.name: op for op in available_ops}
+        op_by_name = self.get_available_index()
 
-        # 2. 遍历规则尝试填充
-        for rule in self.cc_rules:
-            if remaining_slots <= 0:
-                break
-
-            # --- 互斥检查 ---
-            if rule.group and rule.group in used_groups:
+        # 2. 筛选当前可用的规则
+        items = []
+        for i, rule in enumerate(self.cc_rules):
+            # --- 互斥检查 / 空间检查 ---
+            if (rule.group and rule.group in used_groups) or len(rule.operators) > remaining_slots:
                 continue
 
-            # --- 空间检查 ---
-            if len(rule.operators) > remaining_slots:
-                continue
+            # --- 干员可用性检查：拥有、本班次未上班、累计不超过2班、练度 ---
+            if all(op_name in op_by_name and op_name not in shift_used_names and
+                   operator_usage.get(op_name, 0) < 2 and
+                   (ignore_elite or op_by_name[op_name].elite >= rule.elite_requirements.get(op_name, 0))
+                   for op_name in rule.operators):
+                items.append((rule, (round(rule.efficiency, 6), rule.priority, self.rulebook.cc_rule_unlocks[i])))
 
-            # --- 干员可用性检查 ---
-            valid_rule = True
-            for op_name in rule.operators:
-                # A. 检查是否拥有
-                if op_name not in op_by_name:
-                    valid_rule = False;
-                    break
-
-                # B. 检查是否当前班次已上班
-                if op_name in shift_used_names:
-                    valid_rule = False;
-                    break
-
-                # =========================================================
-                # C. [新增关键修复] 检查累计工作班次 (不能超过2班)
-                # =========================================================
-                if operator_usage.get(op_name, 0) >= 2:
-                    valid_rule = False;
-                    break
-
-                # D. 检查练度
-                op_obj = op_by_name[op_name]
-                if not ignore_elite:
-                    req_elite = rule.elite_requirements.get(op_name, 0)
-                    if op_obj.elite < req_elite:
-                        valid_rule = False;
-                        break
-
-            if not valid_rule:
-                continue
-
-            # --- 应用规则 ---
+        # --- 应用规则 ---
+        for rule in self._pack_control_center(items, remaining_slots):
             for op_name in rule.operators:
                 current_cc_ops.append(op_name)
                 shift_used_names.add(op_name)
                 operator_usage[op_name] = operator_usage.get(op_name, 0) + 1
 
-            remaining_slots -= len(rule.operators)
-
-            if rule.group:
-                used_groups.add(rule.group)
+    @staticmethod
+    def _pack_control_center(items: List[Tuple[ControlCenterRule, Tuple]], slots: int) -> List[ControlCenterRule]:
+        """
+        分支定界：每条规则选或不选，同组至多一条、干员不重复、总人数不超过 slots。
+        上界 = 当前值 + 剩余位置数 * 后续规则的“每人价值”最大值（三个分量分别计算，字典序比较）。
+        规则保持优先级顺序、先尝试“选”，因此同分时结果与按优先级贪心一致。
+        """
+        n = len(items)
+        if n == 0:
+            return []
+        dims = len(items[0][1])
+        # suffix[i][d]：第 i 条及之后规则在分量 d 上的每人价值最大值
+        suffix = [[0.0] * dims for _ in range(n + 1)]
+        for i in range(n - 1, -1, -1):
+            rule, value = items[i]
+            for d in range(dims):
+                suffix[i][d] = max(suffix[i + 1][d], value[d] / len(rule.operators))
+
+        best_value = tuple([-1.0] * dims)
+        best_choice: List[int] = []
+        chosen: List[int] = []
+
+        def search(i, free, value, used_ops, used_groups):
+            nonlocal best_value, best_choice
+            if value > best_value:
+                best_value, best_choice = value, chosen.copy()
+            if i == n or free == 0:
+                return
+            bound = tuple(round(value[d] + free * suffix[i][d], 6) for d in range(dims))
+            if bound <= best_value:
+                return
+            rule, item_value = items[i]
+            if len(rule.operators) <= free and not (rule.group and rule.group in used_groups) \
+                    and used_ops.isdisjoint(rule.operators):
+                chosen.append(i)
+                search(i + 1, free - len(rule.operators),
+                       tuple(round(value[d] + item_value[d], 6) for d in range(dims)),
+                       used_ops | set(rule.operators), (used_groups | {rule.group}) if rule.group else used_groups)
+                chosen.pop()
+            search(i + 1, free, value, used_ops, used_groups)
+
+        search(0, slots, tuple([0.0] * dims), frozenset(), frozenset())
+        return [items[i][0] for i in best_choice]
 
     # 辅助方法：减少代码重复
     def _collect_requirements(self, result, shift_used_names, operator_usage,
@@ -961,11 +2004,32 @@ class WorkplaceOptimizer:
         process_req_list(result.hire_requirements, hire_ops)  # 暂时忽略办公室或加对应的集合
 
     def get_optimal_assignments(self, product_requirements: Dict[str, Dict[str, int]] = None,
-                                ignore_elite: bool = False) -> Dict[str, Any]:
+                                ignore_elite: bool = False,
+                                fiammetta_targets: Optional[List[str]] = None,
+                                excluded_operators: Optional[Iterable[str]] = None,
+                                build_plans: bool = True, keep_raw_results: bool = True,
+                                shift_unavailable: Optional[Dict[int, Iterable[str]]] = None) -> Dict[str, Any]:
         """
         获取最优分配方案
         :param ignore_elite: 是否忽略精英化等级限制（潜在最高效率模式）
+        :param fiammetta_targets: 指定菲亚梅塔的充能目标，不指定则按配置选择（启发式或模拟）
+        :param excluded_operators: 本次计算中不使用的干员
+        :param build_plans: 为 False 时只计算 raw_results，不生成 MAA 排班（plans 为空、不计算无人机）
+        :param keep_raw_results: 为 False 时结果中不含 raw_results、solved_results 和 warm_rooms（只需要导出 MAA 排班时使用）
+        :param shift_unavailable: {班次下标(0-2): 干员名} 指定干员在某个班次不可上岗
         """
+        self._begin_run()
+        try:
+            return self._get_optimal_assignments(product_requirements, ignore_elite, fiammetta_targets,
+                                                 excluded_operators, build_plans, keep_raw_results,
+                                                 shift_unavailable)
+        finally:
+            self._end_run()
+
+    def _get_optimal_assignments(self, product_requirements, ignore_elite, fiammetta_targets,
+                                 excluded_operators, build_plans, keep_raw_results=True,
+                                 shift_unavailable=None) -> Dict[str, Any]:
+        self.excluded_operators = set(excluded_operators or ())
         if product_requirements is None:
             product_requirements = self.config_data.get('product_requirements', {
                 "trading_stations": {"LMD": 3, "Orundum": 0},
@@ -976,7 +2040,16 @@ class WorkplaceOptimizer:
         fiammetta_enable = fiammetta_config.get('enable', False)
         # 在潜在模式下，我们假设菲亚梅塔是可用的（只要有）
         fiammetta_available = self.check_fiammetta_available(ignore_elite) if fiammetta_enable else False
-        self.fiammetta_targets = self.select_fiammetta_targets() if fiammetta_available else []
+        if not fiammetta_available:
+            self.fiammetta_targets = []
+        elif fiammetta_targets is not None:
+            self.fiammetta_targets = list(fiammetta_targets)
+        elif fiammetta_config.get('mode') == 'simulate':
+            self.fiammetta_targets = self.select_fiammetta_targets_by_simulation(
+                product_requirements, ignore_elite, pool_size=fiammetta_config.get('candidates', 6),
+                workers=fiammetta_config.get('workers', 0))
+        else:
+            self.fiammetta_targets = self.select_fiammetta_targets()
         if fiammetta_enable and not self.fiammetta_targets:
             fiammetta_enable = False
 
@@ -995,11 +2068,9 @@ class WorkplaceOptimizer:
 
         # --- [修改开始]：构建新的结果头信息 ---
 
-        # 计算基建类型
-        power_station_count = 3
-        # 拼接数字，例如 243
+        # 计算基建类型，拼接数字，例如 243
         building_type_int = int(
-            f"{self.trading_stations_count}{self.manufacturing_stations_count}{power_station_count}")
+            f"{self.trading_stations_count}{self.manufacturing_stations_count}{self.power_stations_count}")
 
         # 动态生成标题和描述
         if ignore_elite:
@@ -1012,17 +2083,22 @@ class WorkplaceOptimizer:
             res_desc = "基于您当前干员的实际练度（精英化等级）生成的最佳排班方案。"
 
         results = {
+            "rulebook_version": self.rulebook.version,  # 计算所用规则库的版本（导出 MAA 排班时不包含）
             "author": "一只摆烂的42的自动基建排班生成器",  # [新增] 固定作者
             "title": res_title,  # [修改] 动态标题
             "description": res_desc,  # [修改] 动态描述
             "buildingType": building_type_int,  # [新增] 243/252等
             "planTimes": "3班",  # [新增] 固定班次
-            "plans": [],
-            "raw_results": []
+            "plans": []
         }
+        if keep_raw_results:
+            results["raw_results"] = []
         # --- [修改结束] ---
 
         operator_usage = {op.name: 0 for op in self.get_available_operators()}
+        shift_results = []
+        # 菲亚梅塔模拟等嵌套求解都在此之前完成，之后 optimize_workplace 记录的就是本方案的房间
+        self._plan_rooms = plan_rooms = []
 
         for shift in range(3):
             current_target = self.fiammetta_targets[
@@ -1039,7 +2115,9 @@ class WorkplaceOptimizer:
                 }
             }
 
-            shift_used_names = set()
+            # 本班不可上岗的干员视为已被占用，也不能满足附属房间需求
+            self._shift_unavailable = frozenset(shift_unavailable.get(shift, ())) if shift_unavailable else frozenset()
+            shift_used_names = set(self._shift_unavailable)
             control_operators = set()
             dormitory_operators = set()
             hire_operators = set()
@@ -1108,26 +2186,111 @@ class WorkplaceOptimizer:
                 ignore_elite
             )
 
-            # 计算无人机
-            plan["drones"] = self._assign_drones(plan, shift)
-
-            results["plans"].append(plan)
-            results["raw_results"].extend(shift_assignments)
-
+            shift_results.append(shift_assignments)
+            if build_plans:
+                results["plans"].append(plan)
+
+        self._shift_unavailable = frozenset()
+        self._plan_rooms = []
+        if keep_raw_results:
+            # 调换房间之前的结果：各方案的第 i 个房间在相同的求解顺序下得出，练度建议按它逐房间对比
+            results["solved_results"] = [res for shift_assignments in shift_results for res in shift_assignments]
+            # 本方案各房间的 (可用性签名, 结果)，save_warm_start 只存这些房间
+            results["warm_rooms"] = plan_rooms
+        if build_plans:
+            # 同类同产物的房间之间调换整组干员，减少换班时的换人次数（不影响效率）
+            if self.config_data.get('minimize_swaps', True):
+                self.minimize_shift_swaps(results["plans"], shift_results)
+
+            # 计算无人机（按调整后的房间序号）
+            shift_drone_candidates = [self._drone_candidates(shift_assignments) for shift_assignments in shift_results]
+            for shift, plan in enumerate(results["plans"]):
+                # 第 1 班换班前加速的是前一天最后一班的房间
+                plan["drones"] = self._assign_drones(plan, shift, shift_drone_candidates[shift],
+                                                     shift_drone_candidates[shift - 1])
+            self._unify_drones(results["plans"], shift_drone_candidates)
+            results["swaps"] = shift_swap_report(results["plans"])
+
+        if keep_raw_results:
+            for shift_assignments in shift_results:
+                results["raw_results"].extend(shift_assignments)
         return results
 
-    def _assign_drones(self, plan: Dict[str, Any], shift_index: int) -> Dict[str, Any]:
+    def export_schedule(self, product_requirements: Dict[str, Dict[str, int]] = None, ignore_elite: bool = False,
+                        compact: bool = False) -> str:
+        """只生成 MAA 排班 JSON 文本（不保留 raw_results）"""
+        results = self.get_optimal_assignments(product_requirements, ignore_elite, keep_raw_results=False)
+        return serialize_schedule(results, compact=compact)
+
+    def simulate_production(self, results: Dict[str, Any], days: Optional[int] = None) -> Dict[str, Any]:
+        """按本优化器的配置模拟方案的实际产出（龙门币、赤金、经验等每天的产量），见 simulate_profile"""
+        return simulate_profile(production_profile(results, self.config_data), days)
+
+    def _drone_candidates(self, shift_assignments: List[AssignmentResult]) -> Dict[Tuple[str, int], Tuple[str, float]]:
+        """本班次可被无人机加速的房间：(room, 1-based index) -> (产物, total_efficiency)"""
+        candidates = {}
+        for res in shift_assignments:
+            prefix, _, index = res.workplace.id.partition('_')
+            if prefix == 'trading':
+                room = 'trading'
+            elif prefix == 'manufacturing':
+                room = 'manufacture'
+            else:
+                continue
+            candidates[(room, int(index))] = (res.workplace.current_product, res.total_efficiency)
+        return candidates
+
+    def _drone_options(self, candidates: Dict[Tuple[str, int], Tuple[str, float]],
+                       previous: Optional[Dict[Tuple[str, int], Tuple[str, float]]]):
+        """
+        换入本班时无人机的可选用法：(房间, 使用时机, 产物, 被加速时的 total_efficiency)。
+        "pre" 在换班前使用，加速的是上一班的干员（previous）；"post" 在换班后使用，加速本班的干员。
+        配置 order 为 "pre"/"post" 时只考虑该时机，为 "auto"（默认）时两种都比较。
         """
-        根据配置和当前排班计算无人机加速对象
+        order = self.config_data.get('drones', {}).get('order', 'auto')
+        orders = ('pre', 'post') if order == 'auto' else (order,)
+        for order in orders:
+            source = previous if order == 'pre' and previous is not None else candidates
+            for key, (product, efficiency) in (source or {}).items():
+                yield key, order, product, efficiency
+
+    def _assign_drones(self, plan: Dict[str, Any], shift_index: int,
+                       candidates: Dict[Tuple[str, int], Tuple[str, float]] = None,
+                       previous: Dict[Tuple[str, int], Tuple[str, float]] = None) -> Dict[str, Any]:
+        """
+        根据配置和当前排班计算无人机加速对象及使用时机（见 _drone_options）
+        - mode "target"（默认）：加速目标产物所在房间中 total_efficiency 最高的一间
+        - mode "auto"：不看目标产物，按 total_efficiency * 产物权重(weights) 选收益最高的房间
         """
         drone_config = self.config_data.get('drones', {})
         if not drone_config.get('enable', False):
             return {"enable": False, "room": "", "index": 0, "order": "pre"}
 
+        mode = drone_config.get('mode', 'target')
         targets = drone_config.get('targets', [])
-        if not targets:
+        if mode != 'auto' and not targets:
             return {"enable": False, "room": "", "index": 0, "order": "pre"}
 
+        # 定义默认结果
+        result = {
+            "room": "",
+            "index": 0,
+            "enable": False,
+            "order": "post" if drone_config.get("order") == "post" else "pre"
+        }
+
+        if mode == 'auto':
+            weights = drone_config.get('weights', {})
+            best, best_gain = None, 0.0
+            for key, order, product, efficiency in self._drone_options(candidates, previous):
+                gain = efficiency * weights.get(product, 1.0)
+                if gain > best_gain:
+                    best, best_gain = (key, order), gain
+            if best:
+                (room, index), order = best
+                result.update(room=room, index=index, enable=True, order=order)
+            return result
+
         # 确定当前班次的目标产物
         # 如果targets只有一个元素，所有班次通用；如果有3个，按班次取
         target_product = targets[0]
@@ -1136,15 +2299,17 @@ class WorkplaceOptimizer:
         elif len(targets) > len(plan):  # 容错
             target_product = targets[shift_index % len(targets)]
 
-        # 定义默认结果
-        result = {
-            "room": "",
-            "index": 0,
-            "enable": False,
-            "order": drone_config.get("order", "pre")
-        }
-
-        # 在排班结果中搜索目标产物所在的房间
+        if candidates:
+            # 目标产物的房间里，选实际效率最高的一间（同效率时贸易站、编号小的、换班前使用优先）
+            matches = [(efficiency, key, order) for key, order, product, efficiency
+                       in self._drone_options(candidates, previous) if product == target_product]
+            if matches:
+                _, (room, index), order = max(matches, key=lambda m: (m[0], m[1][0] == 'trading', -m[1][1],
+                                                                      m[2] == 'pre'))
+                result.update(room=room, index=index, enable=True, order=order)
+            return result
+
+        # 没有房间效率数据时，退回按产物找第一个房间
         # 1. 搜索贸易站 (rooms["trading"])
         # 注意：plan结构中 key 是 "trading" 和 "manufacture"
         for i, room_data in enumerate(plan["rooms"].get("trading", [])):
@@ -1166,34 +2331,410 @@ class WorkplaceOptimizer:
         # 如果没找到（比如配置了加速赤金，但这班全在造经验书），则 disable
         return result
 
-    def select_fiammetta_targets(self) -> List[str]:
-        # 保持原有逻辑
+    def _unify_drones(self, plans: List[Dict[str, Any]],
+                      shift_candidates: List[Dict[Tuple[str, int], Tuple[str, float]]]):
+        """
+        auto 模式且 split 为 false 时，全天固定加速同一个房间：选三个班次加权效率之和最高的房间，
+        每个班次仍各自选收益更高的使用时机。split 为 true（默认）时每个班次各自选择，不做处理。
+        """
+        drone_config = self.config_data.get('drones', {})
+        if not drone_config.get('enable', False) or drone_config.get('mode') != 'auto' \
+                or drone_config.get('split', True):
+            return
+
+        weights = drone_config.get('weights', {})
+        best_orders = []  # 每个班次：房间 -> (加权效率, 使用时机)
+        for shift, candidates in enumerate(shift_candidates):
+            best = {}
+            for key, order, product, efficiency in self._drone_options(candidates, shift_candidates[shift - 1]):
+                gain = efficiency * weights.get(product, 1.0)
+                if key not in best or gain > best[key][0]:
+                    best[key] = (gain, order)
+            best_orders.append(best)
+        totals = {}
+        for best in best_orders:
+            for key, (gain, _) in best.items():
+                totals[key] = totals.get(key, 0.0) + gain
+        if not totals:
+            return
+        room, index = max(totals, key=totals.get)
+        for plan, best in zip(plans, best_orders):
+            order = best[(room, index)][1] if (room, index) in best else plan["drones"]["order"]
+            plan["drones"].update(room=room, index=index, enable=True, order=order)
+
+    def minimize_shift_swaps(self, plans: List[Dict[str, Any]], shift_results: List[List[AssignmentResult]]):
+        """
+        换班时尽量让干员留在原房间。同一班次内，同类型、同产物的房间互换整组干员不影响效率，
+        对每组房间枚举各班次的排列（第 1 班不动），使循环换班（含次日第 1 班）的换人总数最少；
+        房间太多、排列数超过 MAX_SWAP_PERMUTATIONS 时逐班贪心。plans 与 shift_results 原地调整。
+        """
+        if len(plans) < 2:
+            return
+        for room_type, prefix in SWAP_ROOM_GROUPS:
+            groups = {}
+            for i in range(len(plans[0]["rooms"][room_type])):
+                products = tuple(plan["rooms"][room_type][i].get("product", "") for plan in plans)
+                groups.setdefault(products, []).append(i)
+            for indices in groups.values():
+                if len(indices) < 2:
+                    continue
+                teams = [[frozenset(plan["rooms"][room_type][i].get("operators", [])) for i in indices]
+                         for plan in plans]
+                for shift, order in enumerate(_best_room_orders(teams)):
+                    if order == tuple(range(len(indices))):
+                        continue
+                    rooms = plans[shift]["rooms"][room_type]
+                    old_rooms = [rooms[i] for i in indices]
+                    positions = {res.workplace.id: k for k, res in enumerate(shift_results[shift])}
+                    slots = [positions[f"{prefix}_{i + 1}"] for i in indices]
+                    old_results = [shift_results[shift][k] for k in slots]
+                    for j, i in enumerate(indices):
+                        rooms[i] = old_rooms[order[j]]
+                        shift_results[shift][slots[j]] = replace(old_results[order[j]],
+                                                                 workplace=old_results[j].workplace)
+
+    def select_fiammetta_targets(self, limit: int = 3) -> List[str]:
+        # 保持原有逻辑；limit 大于 3 时返回按同样规则排序的候选池（供模拟模式使用）
         candidates = ['巫恋', '龙舌兰', '但书']
         selected = []
         for candidate in candidates:
-            if candidate in self.operators and self.operators[candidate].own:
+            if candidate in self.operators and self.operators[candidate].own \
+                    and candidate not in self.excluded_operators:
                 # 简化判断：只要有就行，因为在 ignore_elite 模式下我们希望尽量利用
                 if self.operators[candidate].elite >= 2:
                     selected.append(candidate)
                 elif self.debug:  # 如果不是E2，记录一下
                     pass
-        if len(selected) >= 3: return selected
+        if len(selected) >= limit: return selected[:limit]
 
         # 补位
         trading_rules = [r for r in self.efficiency_rules if r.workplace_type == 'trading_station']
         op_scores = {}
         for rule in trading_rules:
             for op in rule.operators:
-                if op in self.operators and self.operators[op].own and op not in selected:
+                if op in self.operators and self.operators[op].own and op not in selected \
+                        and op not in self.excluded_operators:
                     # 同样，这里可能选出低练度的，但这符合“潜力”的定义
                     score = rule.synergy_efficiency / len(rule.operators)
                     op_scores[op] = op_scores.get(op, 0) + score
         sorted_ops = sorted(op_scores, key=op_scores.get, reverse=True)
         for op in sorted_ops:
             selected.append(op)
-            if len(selected) >= 3: break
+            if len(selected) >= limit: break
         return selected
 
+    def select_fiammetta_targets_by_simulation(self, product_requirements: Dict[str, Dict[str, int]],
+                                               ignore_elite: bool = False, pool_size: int = 6,
+                                               workers: int = 0) -> List[str]:
+        """
+        模拟模式：从启发式候选池中取所有三人组合，分别完整排三个班次，保留得分最高的一组。
+        得分相同时优先选择第三个班次真正被用上的组合，再按启发式顺序。
+        结果按 (目标集合, 产物, ignore_elite, 排除的干员) 缓存在实例上，当前/潜在两次计算以及重复调用共享。
+        """
+        pool = self.select_fiammetta_targets(limit=pool_size)
+        if len(pool) <= 3:
+            return pool
+
+        excluded = frozenset(self.excluded_operators)
+        memo_key = (json.dumps(product_requirements, sort_keys=True), ignore_elite, excluded)
+        memo = self._fiammetta_memo
+        triples = list(itertools.combinations(pool, 3))
+        pending = [t for t in triples if (frozenset(t), *memo_key) not in memo]
+
+        if pending:
+            if workers and workers > 1:
+                tasks = [(self.operator_data, self.config_data, product_requirements, list(t), ignore_elite,
+                          excluded) for t in pending]
+                outcomes = _run_parallel(_evaluate_fiammetta_task, tasks, self.rulebook, workers)
+            else:
+                outcomes = [_fiammetta_outcome(self.get_optimal_assignments(
+                    product_requirements, ignore_elite, fiammetta_targets=list(t), excluded_operators=excluded), t)
+                    for t in pending]
+            for t, outcome in zip(pending, outcomes):
+                memo[(frozenset(t), *memo_key)] = outcome
+            self.excluded_operators = set(excluded)
+
+        rank = {name: i for i, name in enumerate(pool)}
+        best = max(triples, key=lambda t: (*memo[(frozenset(t), *memo_key)], -sum(rank[n] for n in t)))
+        return list(best)
+
+    def get_top_k_assignments(self, k: int = 5, ignore_elite: bool = False,
+                              product_requirements: Dict[str, Dict[str, int]] = None,
+                              max_evaluations: int = 200, workers: int = 0,
+                              objective: str = "efficiency") -> List[Dict[str, Any]]:
+        """
+        返回 K 个互不相同的最优方案及其与最优方案的得分差。
+        objective 为 "efficiency" 时按效率之和排序，为 "yield" 时按模拟的每天净收益排序。
+        k-best 搜索：从最优方案出发，每次取出当前得分最高、尚未展开的方案，
+        对其贸易站/制造站中的每名干员生成“再排除该干员”的子问题；
+        排除集合相同的子问题只算一次，各房间干员相同的方案（或只互换了完全可互换的干员）只保留一个。
+        :return: [{"result", "score", "gap", "excluded"}]，按得分降序
+        """
+        self._begin_run()  # 各子问题共享房间缓存：排除某名贸易站干员后，制造站结果多数可直接复用
+        try:
+            return self._get_top_k_assignments(k, ignore_elite, product_requirements, max_evaluations, workers,
+                                               objective)
+        finally:
+            self._end_run()
+
+    def _get_top_k_assignments(self, k, ignore_elite, product_requirements, max_evaluations,
+                               workers, objective) -> List[Dict[str, Any]]:
+        if workers and workers > 1:
+            # 每次展开都是一批子问题，整个搜索共用一个进程池
+            with worker_pool(self.rulebook, workers, self.operator_data) as pool:
+                return self._search_top_k(k, ignore_elite, product_requirements, max_evaluations, objective, pool)
+        return self._search_top_k(k, ignore_elite, product_requirements, max_evaluations, objective, None)
+
+    def _search_top_k(self, k, ignore_elite, product_requirements, max_evaluations,
+                      objective, pool) -> List[Dict[str, Any]]:
+        evaluated = {}  # 排除集合 -> (得分, 方案)
+        seen_plans = set()
+        frontier = []  # (-得分, 序号, 排除集合)
+        counter = itertools.count()
+
+        def evaluate(batch: List[frozenset]):
+            batch = [ex for ex in dict.fromkeys(batch) if ex not in evaluated]
+            batch = batch[:max(0, max_evaluations - len(evaluated))]
+            if pool is not None:
+                tasks = [(self.config_data, product_requirements, ignore_elite, ex) for ex in batch]
+                outcomes = _map_tasks(pool, _evaluate_excluded_task, tasks)
+            else:
+                outcomes = [self.get_optimal_assignments(product_requirements, ignore_elite, excluded_operators=ex)
+                            for ex in batch]
+            for excluded, results in zip(batch, outcomes):
+                score = _score_results(results, self.config_data, objective)
+                evaluated[excluded] = (score, results)
+                heapq.heappush(frontier, (-score, next(counter), excluded))
+
+        evaluate([frozenset()])
+        classes = self.interchangeable_classes()
+        alternatives = []
+        while frontier and len(alternatives) < k:
+            _, _, excluded = heapq.heappop(frontier)
+            score, results = evaluated[excluded]
+            signature = _plan_signature(results, classes)
+            if signature in seen_plans:
+                continue
+            seen_plans.add(signature)
+            alternatives.append({"result": results, "score": score, "excluded": sorted(excluded)})
+
+            used = []
+            for plan in results["plans"]:
+                for room_type in ("trading", "manufacture"):
+                    for room in plan["rooms"][room_type]:
+                        used.extend(n for n in room.get("operators", []) if n not in used)
+            evaluate([excluded | {name} for name in used])
+
+        self.excluded_operators = set()
+        best = alternatives[0]["score"] if alternatives else 0.0
+        for alt in alternatives:
+            alt["gap"] = best - alt["score"]
+        return alternatives
+
+    def interchangeable_classes(self) -> Dict[str, Tuple]:
+        """
+        完全可互换的干员：只出现在 apply_each 规则中（不是任何规则的房间需求或条件干员，也不在会客室规则中），
+        所在规则及各规则的精英化要求都相同，且精英化等级相同。返回 干员名 -> 类别，同类别的干员互换不改变任何结果；
+        不在返回值中的干员只和自己等价。清流、菲亚梅塔及其固定目标在排班逻辑中有专门处理，不参与合并。
+        """
+        footprint = {}
+        special = {'清流', '菲亚梅塔', '巫恋', '龙舌兰', '但书'}
+        for rule in self.efficiency_rules:
+            for reqs in (rule.requires_control_center, rule.requires_dormitory, rule.requires_power_station,
+                         rule.requires_hire, rule.requires_processing_station):
+                special.update(req.operator for req in reqs)
+            special.update(name for _, args in rule.when for name, _ in args)
+            if not rule.apply_each or rule.workplace_type == 'meeting_room':
+                special.update(rule.operators)
+                continue
+            for name in rule.operators:
+                footprint.setdefault(name, set()).add((rule.rule_id, rule.elite_requirements.get(name, 0)))
+        classes = {}
+        for op in self.get_available_operators():
+            if op.name in footprint and op.name not in special:
+                classes[op.name] = (tuple(sorted(footprint[op.name])), op.elite)
+        return classes
+
+    def get_operator_sensitivity(self, ignore_elite: bool = False,
+                                 product_requirements: Dict[str, Dict[str, int]] = None,
+                                 per_shift: bool = True) -> List[Dict[str, Any]]:
+        """
+        干员重要性分析：每名干员被移走（整天不可用）或某一班不可用时，贸易站+制造站总效率下降多少。
+        移走干员只会让含有他的规则（作为规则干员、房间需求或 when 条件中的干员）变得不可行；
+        清流还会改变自动化规则在制造站的折算效率。所以只对方案中贸易站/制造站的候选规则（所选规则及其后备规则）
+        涉及的干员重算，制造站候选中有自动化规则时再加上清流，另加菲亚梅塔和她的目标；
+        其余干员不影响任何一步的选择，下降为 0。重算共享房间缓存，与该干员无关的房间直接复用结果。
+        菲亚梅塔的充能目标固定为原方案的目标（除非移走的正是菲亚梅塔或她的目标）。
+        :return: [{"name", "drop", "shift_drops", "rooms"}]，按 drop 降序；未列出的干员下降为 0。
+            排班是逐班贪心的，某班少一名干员可能让后面的班次排得更好，此时下降值为负
+        """
+        self._begin_run()
+        try:
+            base = self.get_optimal_assignments(product_requirements, ignore_elite, build_plans=True)
+            base_score = _plan_score(base)
+            base_targets = list(self.fiammetta_targets)
+
+            owned = self._owned_by_name
+            involved = {}  # 干员名 -> {班次下标: [房间]}
+            for shift, plan in enumerate(base["plans"]):
+                for room_type, rooms in plan["rooms"].items():
+                    for index, room in enumerate(rooms):
+                        for name in room.get("operators", []):
+                            involved.setdefault(name, {}).setdefault(shift, []).append(f"{room_type}{index + 1}")
+                if plan["Fiammetta"]["enable"]:
+                    involved.setdefault('菲亚梅塔', {}).setdefault(shift, []).append("Fiammetta")
+                    involved.setdefault(plan["Fiammetta"]["target"], {}).setdefault(shift, []).append("Fiammetta")
+
+            rooms_seen = set()
+            for res in base["raw_results"]:
+                workplace_type = self.get_workplace_type(res.workplace)
+                if workplace_type not in ('trading_station', 'manufacturing_station'):
+                    continue
+                key = (workplace_type, res.workplace.current_product)
+                if key in rooms_seen:
+                    continue
+                rooms_seen.add(key)
+                for rule in self.candidate_rules(*key):
+                    names = set(rule.operators)
+                    for reqs in (rule.requires_control_center, rule.requires_dormitory, rule.requires_power_station,
+                                 rule.requires_hire, rule.requires_processing_station):
+                        names.update(req.operator for req in reqs)
+                    names.update(name for _, args in rule.when for name, _ in args)
+                    if workplace_type == 'manufacturing_station' and "自动化" in rule.description:
+                        names.add('清流')
+                    for name in names:
+                        if name in owned:
+                            involved.setdefault(name, {})
+
+            def solve(name, **kwargs):
+                pinned = base_targets if base_targets and name != '菲亚梅塔' and name not in base_targets else None
+                results = self.get_optimal_assignments(product_requirements, ignore_elite, fiammetta_targets=pinned,
+                                                       build_plans=False, **kwargs)
+                return base_score - _plan_score(results)
+
+            report = []
+            for name, shifts in involved.items():
+                entry = {"name": name, "drop": solve(name, excluded_operators={name}), "shift_drops": [0.0] * 3,
+                         "rooms": {f"第{s + 1}班": rooms for s, rooms in sorted(shifts.items())}}
+                if per_shift:
+                    # 没在某班上岗的干员也可能通过条件或清流影响该班，三个班都要重算
+                    for shift in range(3):
+                        entry["shift_drops"][shift] = solve(name, shift_unavailable={shift: {name}})
+                report.append(entry)
+        finally:
+            self._end_run()
+            self.excluded_operators = set()
+        report.sort(key=lambda e: (-e["drop"], -max(e["shift_drops"]), e["name"]))
+        return report
+
+    def display_sensitivity(self, report: List[Dict[str, Any]], limit: int = 20):
+        """打印干员重要性排行"""
+        print("=== 干员重要性（移走后效率下降）===")
+        print(f"{'干员':<10}{'整天':>8}{'第1班':>8}{'第2班':>8}{'第3班':>8}  岗位")
+        for entry in report[:limit]:
+            drops = "".join(f"{d:>8.1f}" for d in entry["shift_drops"])
+            rooms = "; ".join(f"{s}: {', '.join(r)}" for s, r in entry["rooms"].items() if r)
+            print(f"{entry['name']:<10}{entry['drop']:>8.1f}{drops}  {rooms}")
+
+    def _acquisition_signature(self, name: str, elite: int) -> Optional[Tuple]:
+        """
+        假设获得干员 name（精英化 elite）后，新增的可行规则集合；返回 None 表示没有任何规则因此变得可行。
+        涉及 name 的规则包括：name 是规则干员、房间需求干员，或出现在规则的 when 条件中。
+        只有这些规则会改变排班，签名相同的两个精英化等级结果相同。
+        """
+        owned = self._owned_by_name
+
+        def satisfied(op_name, required):
+            if op_name == name:
+                return elite >= required
+            return op_name in owned and owned[op_name].elite >= required
+
+        def condition_possible(kind, args):
+            # 静态判断条件能否成立：free/in_shift 要求干员持有（free 还要求精英化），elite_max 要求精英化不超过上限
+            for op_name, level in args:
+                if op_name != name and op_name not in owned:
+                    return False
+                if kind == 'free' and not satisfied(op_name, level):
+                    return False
+                if kind == 'elite_max' and (elite if op_name == name else owned[op_name].elite) > level:
+                    return False
+            return True
+
+        reachable = []
+        for rule in self.efficiency_rules:
+            reqs = [req for reqs in (rule.requires_control_center, rule.requires_dormitory,
+                                     rule.requires_power_station, rule.requires_hire) for req in reqs]
+            if name not in rule.operators and all(req.operator != name for req in reqs) and \
+                    all(op_name != name for _, args in rule.when for op_name, _ in args):
+                continue
+            if not all(satisfied(req.operator, req.elite_required) for req in reqs):
+                continue
+            if not all(condition_possible(kind, args) for kind, args in rule.when):
+                continue
+            if rule.apply_each:
+                members = [name] if name in rule.operators else rule.operators
+                ok = any(satisfied(n, rule.elite_requirements.get(n, 0)) for n in members)
+            else:
+                ok = all(satisfied(n, rule.elite_requirements.get(n, 0)) for n in rule.operators)
+            if ok:
+                reachable.append(rule.rule_id)
+        if not reachable:
+            return None
+        # 会客室加成和菲亚梅塔目标的选择还与该干员本身的精英化等级有关
+        elite_sensitive = name in ('菲亚梅塔', '巫恋', '龙舌兰', '但书') or any(
+            rule.workplace_type == 'meeting_room' and name in rule.operators for rule in self.efficiency_rules)
+        return tuple(reachable), elite if elite_sensitive else None
+
+    def get_acquisition_advice(self, elite_levels: Iterable[int] = (0, 1, 2),
+                               workers: int = 0) -> List[Dict[str, Any]]:
+        """
+        招募建议：对每名未拥有 (own: false) 的干员，估计获得后（各精英化等级）贸易站+制造站总效率的提升。
+        剪枝：不在任何可行规则里的干员不会改变任何一步选择，收益为 0，不计算；
+        （启用菲亚梅塔时，出现在贸易站规则里的干员可能改变充能目标，仍然计算）
+        同一干员不同精英化等级下可行规则相同时只算一次。其余候选在进程池中并行评估，共享同一份规则库。
+        :return: [{"name", "rarity", "gains": {精英化: 提升}, "best_elite", "best_gain"}]，按 best_gain 降序；
+                 未列出的干员、gains 中没有的精英化等级，收益为 0
+        """
+        roster = list(self.operator_data)
+        fiammetta_on = self.config_data.get('Fiammetta', {}).get('enable', False)
+        trading_ops = {n for r in self.efficiency_rules if r.workplace_type == 'trading_station' for n in r.operators}
+
+        jobs = {}  # (干员, 签名) -> 评估下标
+        plans = []  # (干员, 精英化, 评估下标)
+        rosters = [roster]
+        for index, op_data in enumerate(roster):
+            name = op_data['name']
+            if op_data.get('own') or name not in self.operators:
+                continue
+            for elite in elite_levels:
+                signature = self._acquisition_signature(name, elite)
+                if signature is None:
+                    if not fiammetta_on or (name != '菲亚梅塔' and name not in trading_ops):
+                        continue
+                    signature = ('fiammetta', elite)
+                key = (name, signature)
+                if key not in jobs:
+                    jobs[key] = len(rosters)
+                    variant = list(roster)
+                    variant[index] = {**op_data, 'own': True, 'elite': elite, 'level': 1}
+                    rosters.append(variant)
+                plans.append((name, elite, jobs[key]))
+
+        summaries = evaluate_many(rosters, self.config_data, rulebook=self.rulebook, workers=workers,
+                                  engine=self.engine)
+        scores = [sum(eff for shift in summary["shifts"] for room, eff in shift.items()
+                      if room.startswith(('trading', 'manufacturing'))) for summary in summaries]
+
+        advice = {}
+        for name, elite, job in plans:
+            entry = advice.setdefault(name, {"name": name, "rarity": self.operators[name].rarity, "gains": {}})
+            entry["gains"][elite] = scores[job] - scores[0]
+        for entry in advice.values():
+            # 同样的收益取较低的精英化等级
+            entry["best_elite"] = max(entry["gains"], key=lambda e: (entry["gains"][e], -e))
+            entry["best_gain"] = entry["gains"][entry["best_elite"]]
+        return sorted(advice.values(), key=lambda e: (-e["best_gain"], e["best_elite"], e["name"]))
+
     def calculate_upgrade_requirements(self, current_assignments: Dict[str, Any],
                                        potential_assignments: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
@@ -1208,8 +2749,9 @@ class WorkplaceOptimizer:
         fiammetta_impact_rooms = set()
         target_set = set(self.fiammetta_targets) if hasattr(self, 'fiammetta_targets') else set()
 
-        current_raw = current_assignments.get("raw_results", [])
-        potential_raw = potential_assignments.get("raw_results", [])
+        # 两个方案各自调换过房间（minimize_shift_swaps），按调换前的求解顺序对比，同一下标才是同一个房间
+        current_raw = current_assignments.get("solved_results") or current_assignments.get("raw_results", [])
+        potential_raw = potential_assignments.get("solved_results") or potential_assignments.get("raw_results", [])
 
         if len(current_raw) != len(potential_raw):
             return []
@@ -1243,7 +2785,7 @@ class WorkplaceOptimizer:
             total_upgrading_pot_eff = 0.0
 
             for detail in details:
-                rule = detail['rule']
+                rule = self.get_rule(detail['rule_id'])
                 ops_in_rule = detail['ops']  # 这一组分配涉及的干员
                 rule_eff = detail['eff']
                 rule_type = detail.get('type', 'unknown')
@@ -1532,6 +3074,9 @@ class WorkplaceOptimizer:
                             print(f"  宿舍 {i + 1}: {operators}")
             print()
 
+        if assignments.get('swaps'):
+            print("换班换人次数: " + ", ".join(f"{t['from']}→{t['to']}: {t['swaps']}" for t in assignments['swaps']))
+
     # 新增调试打印函数
     def print_loaded_files(self):
         print(f"DEBUG: 已加载的效率文件: {self.efficiency_file}")
@@ -1558,6 +3103,607 @@ class WorkplaceOptimizer:
         for w in ts + ms:
             print(f"  - {w.id} {w.name} | 最大干员: {w.max_operators} | 基础效率: {w.base_efficiency}%")
 
+
+# ----------------- MAA 排班导出 -----------------
+
+# MAA 排班文件的字段顺序；未列出的字段按字母序排在后面
+SCHEDULE_KEYS = ("author", "title", "description", "buildingType", "planTimes", "plans")
+PLAN_KEYS = ("name", "description", "Fiammetta", "rooms", "drones")
+ROOM_KEYS = ("trading", "manufacture", "control", "power", "meeting", "hire", "dormitory", "processing")
+ROOM_ENTRY_KEYS = ("operators", "autofill", "product", "sort", "skip")
+
+
+def _ordered(data: Dict[str, Any], keys: Tuple[str, ...]) -> Dict[str, Any]:
+    ordered = {key: data[key] for key in keys if key in data}
+    for key in sorted(data):
+        if key not in ordered:
+            ordered[key] = data[key]
+    return ordered
+
+
+def schedule_dict(results: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    从 get_optimal_assignments 的结果中取出 MAA 排班（字段顺序固定）。
+    只读取排班字段，忽略 raw_results 等内部数据，不复制整个结果。
+    """
+    plans = []
+    for plan in results.get("plans", []):
+        ordered_plan = _ordered(plan, PLAN_KEYS)
+        ordered_plan["rooms"] = _ordered({
+            room: [_ordered(entry, ROOM_ENTRY_KEYS) for entry in entries]
+            for room, entries in plan.get("rooms", {}).items()
+        }, ROOM_KEYS)
+        plans.append(ordered_plan)
+    schedule = _ordered({key: value for key, value in results.items() if key in SCHEDULE_KEYS}, SCHEDULE_KEYS)
+    schedule["plans"] = plans
+    return schedule
+
+
+def serialize_schedule(results: Dict[str, Any], compact: bool = False) -> str:
+    """
+    把 get_optimal_assignments 的结果直接写成 MAA 排班 JSON。
+    :param compact: 为 True 时不缩进、不留空格
+    """
+    schedule = schedule_dict(results)
+    if compact:
+        return json.dumps(schedule, ensure_ascii=False, separators=(',', ':'))
+    return json.dumps(schedule, ensure_ascii=False, indent=2)
+
+
+# ----------------- 换班换人次数 -----------------
+
+# 可以互换整组干员的房间：(plan 中的房间类型, 工作站 id 前缀)
+SWAP_ROOM_GROUPS = (('manufacture', 'manufacturing'), ('trading', 'trading'), ('power', 'power'))
+MAX_SWAP_PERMUTATIONS = 1000
+
+
+def _count_swaps(prev_plan: Dict[str, Any], next_plan: Dict[str, Any]) -> int:
+    """换班时的换人次数：下一班各房间里，上一班不在同一房间（同类型、同序号）的干员数"""
+    swaps = 0
+    for room_type, rooms in next_plan["rooms"].items():
+        prev_rooms = prev_plan["rooms"].get(room_type, [])
+        for i, room in enumerate(rooms):
+            prev_ops = set(prev_rooms[i].get("operators", [])) if i < len(prev_rooms) else set()
+            swaps += sum(1 for name in room.get("operators", []) if name not in prev_ops)
+    return swaps
+
+
+def shift_swap_report(plans: List[Dict[str, Any]]) -> List[Dict[str, int]]:
+    """每次换班（含最后一班到次日第 1 班）的换人次数：[{"from", "to", "swaps"}]，班次从 1 开始"""
+    if len(plans) < 2:
+        return []
+    return [{"from": i + 1, "to": (i + 1) % len(plans) + 1,
+             "swaps": _count_swaps(plans[i], plans[(i + 1) % len(plans)])}
+            for i in range(len(plans))]
+
+
+def _best_room_orders(teams: List[List[frozenset]]) -> List[Tuple[int, ...]]:
+    """
+    teams[班次][位置] 为一组可互换房间里的干员。返回每个班次的排列 order（新位置 j 放原位置 order[j] 的干员），
+    使循环换班的换人总数最少；代价相同时保持原顺序。
+    """
+    shifts, n = len(teams), len(teams[0])
+    # cost[s][a][b]：第 s 班位置 a 的房间换成第 s+1 班位置 b 的干员时的换人数
+    cost = [[[len(teams[(s + 1) % shifts][b] - teams[s][a]) for b in range(n)] for a in range(n)]
+            for s in range(shifts)]
+    identity = tuple(range(n))
+    perms = list(itertools.permutations(range(n)))
+
+    def total(orders):
+        return sum(cost[s][orders[s][j]][orders[(s + 1) % shifts][j]] for s in range(shifts) for j in range(n))
+
+    if len(perms) ** (shifts - 1) <= MAX_SWAP_PERMUTATIONS:
+        best = [identity] * shifts
+        best_cost = total(best)
+        for rest in itertools.product(perms, repeat=shifts - 1):
+            orders = [identity, *rest]
+            c = total(orders)
+            if c < best_cost:
+                best, best_cost = orders, c
+        return best
+
+    orders = [identity]
+    for s in range(1, shifts):
+        prev = orders[-1]
+        orders.append(min(perms, key=lambda p: (sum(cost[s - 1][prev[j]][p[j]] for j in range(n)), p != identity)))
+    return orders
+
+
+# ----------------- 并行评估工具 -----------------
+
+# 进程池 worker 内共享的规则库和干员数据，由 _init_worker 在 worker 启动时设置一次
+_WORKER_RULEBOOK: Optional[RuleBook] = None
+_WORKER_OPERATORS: Optional[List[Dict]] = None
+
+
+def _init_worker(rulebook: RuleBook, operator_data: Optional[List[Dict]] = None):
+    global _WORKER_RULEBOOK, _WORKER_OPERATORS
+    _WORKER_RULEBOOK = rulebook
+    _WORKER_OPERATORS = operator_data
+
+
+@contextmanager
+def worker_pool(rulebook: RuleBook, workers: int = 0, operator_data: Optional[List[Dict]] = None):
+    """
+    一次搜索共用的进程池：规则库和干员数据只在 worker 启动时传一次，之后各批任务复用同一个池。
+    workers <= 1 时不起进程，返回 None，由 _map_tasks 在当前进程串行执行。
+    """
+    if workers is None or workers <= 1:
+        _init_worker(rulebook, operator_data)
+        yield None
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(rulebook, operator_data)) as pool:
+        yield pool
+
+
+def _map_tasks(pool, func, tasks: List[Any]) -> List[Any]:
+    """在 worker_pool 返回的池中执行 func(task)，返回值与 tasks 顺序一致"""
+    if pool is None:
+        return [func(task) for task in tasks]
+    return list(pool.map(func, tasks))
+
+
+def _run_parallel(func, tasks: List[Any], rulebook: RuleBook, workers: int = 0):
+    """
+    单批任务：临时起一个进程池执行 func(task)，worker 启动时预加载同一份规则库。
+    workers <= 1 时在当前进程串行执行（便于调试，也避免在 Streamlit 里起进程）。
+    需要分多批评估时用 worker_pool 复用同一个池。
+    """
+    with worker_pool(rulebook, workers if len(tasks) > 1 else 0) as pool:
+        return _map_tasks(pool, func, tasks)
+
+
+def _plan_score(results: Dict[str, Any]) -> float:
+    """方案得分：三个班次所有贸易站、制造站 total_efficiency 之和"""
+    score = 0.0
+    for res in results.get("raw_results", []):
+        if res.workplace.id.startswith(('trading', 'manufacturing')):
+            score += res.total_efficiency
+    return score
+
+
+def _fiammetta_outcome(results: Dict[str, Any], targets: Tuple[str, ...]) -> Tuple[float, int]:
+    """(方案得分, 真正上了第三个班的充能目标数)"""
+    shifts_worked = {}
+    for plan in results["plans"]:
+        for room in plan["rooms"]["trading"]:
+            for name in room.get("operators", []):
+                shifts_worked[name] = shifts_worked.get(name, 0) + 1
+    return _plan_score(results), sum(1 for t in targets if shifts_worked.get(t, 0) >= 3)
+
+
+def _evaluate_fiammetta_task(task) -> Tuple[float, int]:
+    operator_data, config_data, product_requirements, targets, ignore_elite, excluded = task
+    optimizer = WorkplaceOptimizer(None, None, rulebook=_WORKER_RULEBOOK,
+                                   operator_data=operator_data, config_data=config_data)
+    results = optimizer.get_optimal_assignments(product_requirements, ignore_elite, fiammetta_targets=targets,
+                                                excluded_operators=excluded)
+    return _fiammetta_outcome(results, tuple(targets))
+
+
+def _plan_signature(results: Dict[str, Any], classes: Mapping[str, Any]) -> Tuple:
+    """
+    方案去重用的签名：每个班次每个房间的干员集合，以及菲亚梅塔的目标。
+    干员先按 classes（见 WorkplaceOptimizer.interchangeable_classes）换成可互换类别，
+    只有互换了完全可互换的干员的方案才视为重复；效率相同但干员不同的方案都保留。
+    """
+    rooms = tuple(tuple(sorted(repr(classes.get(op.name, op.name)) for op in res.optimal_operators))
+                  for res in results["raw_results"])
+    targets = tuple(repr(classes.get(plan["Fiammetta"]["target"], plan["Fiammetta"]["target"]))
+                    for plan in results.get("plans", []) if plan["Fiammetta"]["enable"])
+    return rooms, targets
+
+
+def _evaluate_excluded_task(task) -> Dict[str, Any]:
+    config_data, product_requirements, ignore_elite, excluded = task
+    optimizer = WorkplaceOptimizer(None, None, rulebook=_WORKER_RULEBOOK,
+                                   operator_data=_WORKER_OPERATORS, config_data=config_data)
+    return optimizer.get_optimal_assignments(product_requirements, ignore_elite, excluded_operators=excluded)
+
+
+# ----------------- 产出模拟 -----------------
+
+# 默认参数（可在配置的 "simulation" 中覆盖）。配方按 100% 效率计：
+#   制造站：每 minutes 分钟产出 amount 个 item（不计原料）
+#   贸易站：每 minutes 分钟生成一个订单，交付时消耗 cost 个 cost_item，得到 amount 个 item；
+#           龙门币订单按 3 级贸易站 2/3/4 赤金订单 30%/50%/20% 的期望值折算
+SIMULATION_DEFAULTS = {
+    "days": 1,
+    "shift_hours": None,  # None 表示 24 小时按班次数平分；也可以是列表，如 [12, 6, 6]
+    "collections_per_shift": 1,  # 每班收取产物、交付订单的次数（MAA 默认只在换班时）
+    "drones_per_hour": 10.0,  # 不计发电站加成时每小时回复的无人机数
+    "drone_minutes": 3.0,  # 每架无人机加速的分钟数（按房间当前效率）
+    "order_limit": 10,  # 每个贸易站最多积压的未交付订单数，满了就不再生成
+    "initial_stock": {},  # 初始库存，如 {"Pure Gold": 40}
+    "weights": {"LMD": 1.0, "EXP": 1.0, "Pure Gold": 500.0},  # 折算总收益时各物品（净产出）的价值
+    "recipes": {
+        "manufacture": {
+            "Pure Gold": {"minutes": 72.0, "item": "Pure Gold", "amount": 1.0},
+            "Battle Record": {"minutes": 180.0, "item": "EXP", "amount": 1000.0},
+            "Originium Shard": {"minutes": 60.0, "item": "Originium Shard", "amount": 1.0},
+        },
+        "trading": {
+            "LMD": {"minutes": 203.4, "cost_item": "Pure Gold", "cost": 2.9, "item": "LMD", "amount": 1450.0},
+            "Orundum": {"minutes": 120.0, "cost_item": "Originium Shard", "cost": 2.0, "item": "Orundum",
+                        "amount": 20.0},
+        },
+    },
+}
+
+
+@dataclass(frozen=True, slots=True)
+class ProductionProfile:
+    """
+    编译后的方案：每个收取周期的产出量都已算好，模拟时只剩加减法。
+    shifts 中每项为 (周期数, ((物品, 每周期产量), ...), ((贸易站序号, 每周期订单数, 原料, 单价, 物品, 单份收益), ...))
+    """
+    shifts: Tuple[Tuple[int, Tuple[Tuple[str, float], ...], Tuple[Tuple[int, float, str, float, str, float], ...]], ...]
+    trading_slots: int
+    order_limit: float
+    initial_stock: Tuple[Tuple[str, float], ...]
+    weights: Tuple[Tuple[str, float], ...]
+    days: int
+
+
+def simulation_settings(config_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """默认参数与配置中 "simulation" 合并（recipes、weights 按条目覆盖）"""
+    overrides = (config_data or {}).get('simulation', {})
+    settings = {key: value for key, value in SIMULATION_DEFAULTS.items() if key not in ('recipes', 'weights')}
+    settings.update({key: value for key, value in overrides.items() if key not in ('recipes', 'weights')})
+    settings['weights'] = {**SIMULATION_DEFAULTS['weights'], **overrides.get('weights', {})}
+    settings['recipes'] = {
+        room: {**recipes, **overrides.get('recipes', {}).get(room, {})}
+        for room, recipes in SIMULATION_DEFAULTS['recipes'].items()
+    }
+    return settings
+
+
+def production_profile(results: Dict[str, Any], config_data: Optional[Dict[str, Any]] = None) -> ProductionProfile:
+    """
+    把 get_optimal_assignments 的结果（需要 raw_results）编译成 ProductionProfile。
+    各房间按班次的 total_efficiency 生产；无人机按发电站加成后的速度回复，在下一次换班时全部用掉：
+    下一班的 drones.order 为 "pre" 时在换班前使用，按本班该房间的效率加速；为 "post" 时在换班后使用，
+    按下一班的效率加速。菲亚梅塔充能带来的第三个班已体现在各班次的效率里。
+    """
+    raw = results.get("raw_results")
+    if not raw:
+        raise ValueError("产出模拟需要 raw_results（get_optimal_assignments 的 keep_raw_results=True）")
+    settings = simulation_settings(config_data)
+    manufacture_recipes = settings['recipes']['manufacture']
+    trading_recipes = settings['recipes']['trading']
+
+    rooms_per_shift = len({res.workplace.id for res in raw})
+    shift_count = len(raw) // rooms_per_shift
+    plans = results.get("plans", [])
+    hours = settings['shift_hours'] or [24 / shift_count] * shift_count
+    steps = max(1, int(settings['collections_per_shift']))
+
+    # 每班换入时的无人机：(目标房间, 使用时机)，以及每班回复的无人机可加速的分钟数（按收取周期平摊）
+    drone_uses, drone_minutes = [], []
+    for shift in range(shift_count):
+        shift_results = raw[shift * rooms_per_shift:(shift + 1) * rooms_per_shift]
+        drones = plans[shift].get("drones", {}) if shift < len(plans) else {}
+        drone_uses.append(((drones.get("room"), drones.get("index")), drones.get("order", "pre"))
+                          if drones.get("enable") else (None, None))
+        step_minutes = hours[shift % len(hours)] * 60 / steps
+        power_bonus = sum(res.total_efficiency - res.workplace.base_efficiency for res in shift_results
+                          if res.workplace.id.startswith('power'))
+        drone_minutes.append(settings['drones_per_hour'] * (1 + power_bonus / 100) * step_minutes / 60
+                             * settings['drone_minutes'])
+
+    shifts = []
+    trading_slots = 0
+    for shift in range(shift_count):
+        shift_results = raw[shift * rooms_per_shift:(shift + 1) * rooms_per_shift]
+        plan = plans[shift] if shift < len(plans) else None
+        step_minutes = hours[shift % len(hours)] * 60 / steps
+        # 本班回复的无人机在下一班换班前使用（pre），或上一班回复的无人机在本班换班后使用（post）
+        boosts = {}
+        next_target, next_order = drone_uses[(shift + 1) % shift_count]
+        if next_target and next_order == "pre":
+            boosts[next_target] = boosts.get(next_target, 0.0) + drone_minutes[shift]
+        target, order = drone_uses[shift]
+        if target and order != "pre":
+            boosts[target] = boosts.get(target, 0.0) + drone_minutes[shift - 1]
+
+        output, orders = {}, []
+        for res in shift_results:
+            prefix, _, index = res.workplace.id.partition('_')
+            if prefix not in ('manufacturing', 'trading'):
+                continue
+            room = 'manufacture' if prefix == 'manufacturing' else 'trading'
+            index = int(index)
+            product = res.workplace.current_product
+            if plan and index <= len(plan["rooms"][room]):
+                product = plan["rooms"][room][index - 1].get("product", product)
+            recipe = (manufacture_recipes if room == 'manufacture' else trading_recipes).get(product)
+            if not recipe:
+                continue
+            minutes = step_minutes + boosts.get((room, index), 0.0)
+            cycles = minutes * res.total_efficiency / 100 / recipe['minutes']
+            if room == 'manufacture':
+                output[recipe['item']] = output.get(recipe['item'], 0.0) + cycles * recipe['amount']
+            else:
+                orders.append((index - 1, cycles, recipe['cost_item'], recipe['cost'], recipe['item'],
+                               recipe['amount']))
+                trading_slots = max(trading_slots, index)
+        shifts.append((steps, tuple(output.items()), tuple(orders)))
+
+    return ProductionProfile(
+        shifts=tuple(shifts), trading_slots=trading_slots, order_limit=float(settings['order_limit']),
+        initial_stock=tuple(settings['initial_stock'].items()), weights=tuple(settings['weights'].items()),
+        days=int(settings['days']))
+
+
+def simulate_profile(profile: ProductionProfile, days: Optional[int] = None) -> Dict[str, Any]:
+    """
+    按收取周期离散地模拟 days 天：周期内制造站入库、贸易站生成订单（积压到上限后停止），
+    周期末按库存交付订单（贸易站按编号依次交付，原料不足时只交付一部分）。
+    :return: {"days", "produced", "consumed", "net"（以上均为每天平均）, "stock"（期末库存）,
+              "pending_orders", "capped_orders"（每天因订单上限少生成的订单数）, "score"（按 weights 折算的每天净收益）}
+    """
+    days = profile.days if days is None else days
+    stock = dict(profile.initial_stock)
+    produced, consumed = {}, {}
+    pending = [0.0] * profile.trading_slots
+    limit = profile.order_limit
+    capped = 0.0
+
+    for _ in range(days):
+        for steps, output, orders in profile.shifts:
+            for _ in range(steps):
+                for item, amount in output:
+                    produced[item] = produced.get(item, 0.0) + amount
+                    stock[item] = stock.get(item, 0.0) + amount
+                for slot, new_orders, *_ in orders:
+                    room = limit - pending[slot]
+                    if new_orders > room:
+                        capped += new_orders - room
+                        new_orders = room
+                    pending[slot] += new_orders
+                for slot, _, cost_item, cost, item, amount in orders:
+                    delivered = min(pending[slot], stock.get(cost_item, 0.0) / cost)
+                    if delivered <= 0:
+                        continue
+                    pending[slot] -= delivered
+                    stock[cost_item] = max(stock[cost_item] - delivered * cost, 0.0)
+                    stock[item] = stock.get(item, 0.0) + delivered * amount
+                    consumed[cost_item] = consumed.get(cost_item, 0.0) + delivered * cost
+                    produced[item] = produced.get(item, 0.0) + delivered * amount
+
+    days = max(days, 1)
+    produced = {item: amount / days for item, amount in produced.items()}
+    consumed = {item: amount / days for item, amount in consumed.items()}
+    net = {item: produced.get(item, 0.0) - consumed.get(item, 0.0) for item in {*produced, *consumed}}
+    return {
+        "days": days,
+        "produced": produced,
+        "consumed": consumed,
+        "net": net,
+        "stock": stock,
+        "pending_orders": sum(pending),
+        "capped_orders": capped / days,
+        "score": sum(weight * net.get(item, 0.0) for item, weight in profile.weights),
+    }
+
+
+def _yield_score(results: Dict[str, Any], config_data: Optional[Dict[str, Any]] = None) -> float:
+    """方案得分（实际产出）：模拟后按 weights 折算的每天净收益"""
+    return simulate_profile(production_profile(results, config_data))["score"]
+
+
+def _score_results(results: Dict[str, Any], config_data: Optional[Dict[str, Any]], objective: str) -> float:
+    """objective 为 "efficiency"（效率之和）或 "yield"（模拟产出）"""
+    if objective == "yield":
+        return _yield_score(results, config_data)
+    if objective != "efficiency":
+        raise ValueError(f"未知的优化目标: {objective}")
+    return _plan_score(results)
+
+
+# ----------------- 单用户分析 -----------------
+
+def analyze_roster(operator_data: List[Dict], config_data: Dict[str, Any],
+                   rulebook: Optional[RuleBook] = None, warm_start: Optional[str] = None) -> Dict[str, Any]:
+    """
+    完整分析一名客户：当前练度排班、潜在最高效率排班与练度建议（结果可直接转成 JSON）。
+    进程池 worker 中不传 rulebook 时使用 worker 预加载的规则库。
+    warm_start 为该客户的热启动存档路径：先载入上次的结果，分析后写回。
+    """
+    rulebook = rulebook or _WORKER_RULEBOOK or RuleBook.from_file("efficiency.json")
+    optimizer = WorkplaceOptimizer(None, None, rulebook=rulebook, operator_data=operator_data,
+                                   config_data=config_data)
+    if warm_start:
+        optimizer.load_warm_start(warm_start)
+    current = optimizer.get_optimal_assignments(ignore_elite=False)
+    potential = optimizer.get_optimal_assignments(ignore_elite=True)
+    if warm_start:
+        optimizer.save_warm_start(warm_start, current, potential)
+    return {
+        "rulebook_version": rulebook.version,
+        "score": _plan_score(current),
+        "potential_score": _plan_score(potential),
+        "plan": schedule_dict(current),
+        "potential": schedule_dict(potential),
+        "suggestions": optimizer.calculate_upgrade_requirements(current, potential),
+    }
+
+
+# ----------------- 批量评估 -----------------
+
+def _summarize_results(results: Dict[str, Any], rooms_per_shift: int) -> Dict[str, Any]:
+    raw = results["raw_results"]
+    shifts = [{res.workplace.id: res.total_efficiency for res in raw[i:i + rooms_per_shift]}
+              for i in range(0, len(raw), rooms_per_shift)]
+    return {"total_efficiency": sum(res.total_efficiency for res in raw), "shifts": shifts}
+
+
+def _evaluate_rosters_task(task) -> List[Dict[str, Any]]:
+    rosters, config, ignore_elite, build_plans, engine = task
+    optimizer = None
+    summaries = []
+    for roster in rosters:
+        if optimizer is None:
+            optimizer = WorkplaceOptimizer(None, None, rulebook=_WORKER_RULEBOOK, operator_data=roster,
+                                           config_data=config, engine=engine)
+            rooms_per_shift = sum(len(v) for v in optimizer.workplaces.values())
+        else:
+            optimizer.load_roster(roster)
+        results = optimizer.get_optimal_assignments(ignore_elite=ignore_elite, build_plans=build_plans)
+        summary = _summarize_results(results, rooms_per_shift)
+        if build_plans:
+            summary["result"] = results
+        summaries.append(summary)
+    return summaries
+
+
+def evaluate_many(rosters: List[List[Dict]], config: Dict[str, Any], efficiency_file: str = "efficiency.json",
+                  ignore_elite: bool = False, build_plans: bool = False, workers: int = 0,
+                  rulebook: RuleBook = None, engine: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    批量评估多份干员数据（或同一份数据的不同变体），配置相同。
+    规则库只编译一次；每个进程只创建一个优化器，逐份切换干员数据，复用工作站与评分矩阵。
+    :return: 与 rosters 顺序一致，每项为
+             {"total_efficiency": 全部房间三个班次之和, "shifts": [{房间id: total_efficiency}, ...]}，
+             build_plans 为 True 时额外包含完整结果 "result"
+    """
+    rulebook = rulebook or RuleBook.from_file(efficiency_file)
+    if not rosters:
+        return []
+    chunks = max(1, min(workers or 1, len(rosters)))
+    size = -(-len(rosters) // chunks)
+    tasks = [(rosters[i:i + size], config, ignore_elite, build_plans, engine)
+             for i in range(0, len(rosters), size)]
+    return [summary for chunk in _run_parallel(_evaluate_rosters_task, tasks, rulebook, workers)
+            for summary in chunk]
+
+
+# ----------------- 布局与产物自动搜索 -----------------
+
+# 左侧基建共 9 个房间位置：贸易站 + 制造站 + 发电站
+LAYOUT_SLOTS = 9
+# 电力（均按满级设施）：3 级发电站供电 270，3 级贸易站/制造站各耗电 60，
+# 其余设施（4 个 5 级宿舍、会客室、办公室、训练室、加工站）共耗电 450。333 / 243 正好用满 810
+POWER_PER_STATION = 270
+POWER_PER_ROOM = 60
+POWER_OTHER_FACILITIES = 450
+
+
+def layout_power_balance(trading: int, manufacturing: int, power: int,
+                         other_consumption: int = POWER_OTHER_FACILITIES) -> int:
+    """布局的电力余量（供电 - 耗电），小于 0 表示该布局在满级设施下供电不足"""
+    return power * POWER_PER_STATION - (trading + manufacturing) * POWER_PER_ROOM - other_consumption
+
+
+def enumerate_layouts(min_power: int = 2, max_power: int = 3,
+                      max_trading: int = 4, max_manufacturing: int = 5) -> List[Tuple[int, int, int]]:
+    """枚举可行布局 (贸易站, 制造站, 发电站)，例如 (2, 4, 3)、(3, 3, 3)、(2, 5, 2)、(1, 5, 3)"""
+    layouts = []
+    for power in range(min_power, max_power + 1):
+        for trading in range(1, max_trading + 1):
+            manufacturing = LAYOUT_SLOTS - power - trading
+            if 1 <= manufacturing <= max_manufacturing:
+                layouts.append((trading, manufacturing, power))
+    return layouts
+
+
+def enumerate_product_mixes(trading_count: int, manufacturing_count: int,
+                            gold_per_trading: float = 2 / 3) -> List[Dict[str, Dict[str, int]]]:
+    """
+    枚举产物分配。贸易站全部做龙门币，制造站在赤金/作战记录之间分配；
+    赤金制造站数量至少为 ceil(贸易站数 * gold_per_trading)，保证贸易站不断粮（333 为 2 赤金，243 为 2 赤金）。
+    """
+    min_gold = max(1, math.ceil(trading_count * gold_per_trading - 1e-9))
+    mixes = []
+    for gold in range(min_gold, manufacturing_count + 1):
+        manufacturing = {"Pure Gold": gold}
+        if manufacturing_count - gold > 0:
+            manufacturing["Battle Record"] = manufacturing_count - gold
+        mixes.append({"trading_stations": {"LMD": trading_count}, "manufacturing_stations": manufacturing})
+    return mixes
+
+
+def _evaluate_layout_task(task: Tuple[Dict[str, Any], bool, str]) -> float:
+    config_data, ignore_elite, objective = task
+    optimizer = WorkplaceOptimizer(None, None, rulebook=_WORKER_RULEBOOK,
+                                   operator_data=_WORKER_OPERATORS, config_data=config_data)
+    return _score_results(optimizer.get_optimal_assignments(ignore_elite=ignore_elite), config_data, objective)
+
+
+def search_layouts(efficiency_file: str, operator_data: List[Dict], base_config: Dict[str, Any] = None,
+                   layouts: List[Tuple[int, int, int]] = None, top_n: int = 5, workers: int = 0,
+                   ignore_elite: bool = False, rulebook: RuleBook = None,
+                   objective: str = "efficiency",
+                   power_other_consumption: int = POWER_OTHER_FACILITIES) -> List[Dict[str, Any]]:
+    """
+    自动搜索布局与产物分配。
+    所有候选共享同一份规则库并行评估；按上界从高到低分批评估，
+    上界已低于当前第 top_n 名得分的候选直接剪枝。返回按得分降序的列表。
+    objective 为 "yield" 时按模拟的每天净收益排序；效率上界对产出不成立，此时不剪枝。
+    得分不含发电站的贡献，少建发电站总是更划算，所以先按 layout_power_balance 去掉供电不足的布局；
+    满级设施下只有 3 个发电站的布局可行，宿舍等未满级（耗电更少）时用 power_other_consumption 调整。
+
+    :param operator_data: operators.json 的内容
+    :param base_config: 其余配置（菲亚梅塔、无人机等）沿用这里的设置
+    :param top_n: 需要的名次数，<= 0 表示不剪枝、全部评估
+    :param workers: 进程数，<= 1 为串行
+    :param power_other_consumption: 贸易站、制造站以外设施的总耗电
+    """
+    rulebook = rulebook or RuleBook.from_file(efficiency_file)
+    base_config = base_config or {}
+    layouts = layouts or enumerate_layouts()
+    underpowered = [layout for layout in layouts
+                    if layout_power_balance(*layout, other_consumption=power_other_consumption) < 0]
+    if underpowered:
+        print(f"[layout] 跳过供电不足的布局: {', '.join(''.join(map(str, layout)) for layout in underpowered)}")
+    layouts = [layout for layout in layouts if layout not in underpowered]
+
+    candidates = []
+    for trading, manufacturing, power in layouts:
+        for mix in enumerate_product_mixes(trading, manufacturing):
+            config = copy.deepcopy(base_config)
+            config.update({
+                "layout": f"{trading}-{manufacturing}-{power}",
+                "desc": f"{trading}{manufacturing}{power} 自动搜索",
+                "product_requirements": mix,
+                "trading_stations_count": trading,
+                "manufacturing_stations_count": manufacturing,
+                "power_stations_count": power,
+            })
+            # 上界：房间基础效率 + 干员份额上界，三个班次
+            optimizer = WorkplaceOptimizer(None, None, rulebook=rulebook,
+                                           operator_data=operator_data, config_data=config)
+            rooms = optimizer.workplaces['trading_stations'] + optimizer.workplaces['manufacturing_stations']
+            room_types = [('trading_station', p) for p in mix['trading_stations']] + \
+                         [('manufacturing_station', p) for p in mix['manufacturing_stations']]
+            bound = 3 * sum(w.base_efficiency for w in rooms) + optimizer.synergy_upper_bound(
+                room_types, 3 * sum(w.max_operators for w in rooms), ignore_elite)
+            candidates.append({"layout": f"{trading}{manufacturing}{power}", "config": config,
+                               "upper_bound": bound, "score": None})
+
+    candidates.sort(key=lambda c: c["upper_bound"], reverse=True)
+    batch_size = max(1, workers or 1)
+    evaluated = []
+    with worker_pool(rulebook, workers, operator_data) as pool:
+        for start in range(0, len(candidates), batch_size):
+            batch = candidates[start:start + batch_size]
+            if objective == "efficiency" and top_n > 0 and len(evaluated) >= top_n:
+                threshold = sorted((c["score"] for c in evaluated), reverse=True)[top_n - 1]
+                batch = [c for c in batch if c["upper_bound"] > threshold]
+                if not batch:
+                    break  # 候选按上界降序，后面的只会更低
+            scores = _map_tasks(pool, _evaluate_layout_task,
+                                [(c["config"], ignore_elite, objective) for c in batch])
+            for c, score in zip(batch, scores):
+                c["score"] = score
+                evaluated.append(c)
+
+    evaluated.sort(key=lambda c: c["score"], reverse=True)
+    return evaluated[:top_n] if top_n > 0 else evaluated
+
 # if __name__ == "__main__":
 #     optimizer = WorkplaceOptimizer('efficiency.json', 'operators.json', 'config.json')
 #
@@ -0,0 +1,297 @@
+# service.py
+# 无界面的本地 JSON 排班服务（仅标准库）：
+#   python service.py serve [--port 8765] [--workers 4]
+#   python service.py replay captured.jsonl [--url http://127.0.0.1:8765] [--concurrency 8]
+#
+# 接口：
+#   GET  /health   -> {"status", "rulebook_version", "workers"}
+#   POST /analyze  {"user_hash": "..."} 或 {"operators": [...], "config": {...}}
+#                  -> {"rulebook_version", "score", "potential_score", "plan", "potential", "suggestions"}
+#   POST /batch    {"requests": [<analyze 请求>, ...]} -> {"results": [...]}（单条出错时该条为 {"error": ...}）
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import logic
+
+USER_DATA_DIR = "user_data"
+WARM_START_FILE = "warm_start.pkl"
+MAX_BODY_BYTES = 16 * 1024 * 1024
+OPERATOR_FIELDS = ('id', 'name', 'elite', 'level', 'own', 'potential', 'rarity')
+
+
+class RequestError(Exception):
+    """请求本身有问题（返回 4xx）"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ==========================================
+# 1. worker 端
+# ==========================================
+
+def load_request_data(request):
+    """从请求中取出 (干员数据, 配置)：按 user_hash 读取已存储的客户数据，或直接使用内联数据"""
+    if not isinstance(request, dict):
+        raise RequestError(400, "请求应为 JSON 对象")
+    if 'user_hash' in request:
+        user_hash = str(request['user_hash'])
+        if not re.fullmatch(r"[0-9a-f]{16}", user_hash):
+            raise RequestError(400, "user_hash 格式错误")
+        base_path = os.path.join(USER_DATA_DIR, user_hash)
+        ops_path = os.path.join(base_path, "operators.json")
+        conf_path = os.path.join(base_path, "config.json")
+        if not (os.path.exists(ops_path) and os.path.exists(conf_path)):
+            raise RequestError(404, "未找到该用户的数据")
+        with open(ops_path, 'r', encoding='utf-8') as f:
+            ops = json.load(f)
+        with open(conf_path, 'r', encoding='utf-8') as f:
+            conf = json.load(f)
+        return ops, conf
+    if isinstance(request.get('operators'), list):
+        validate_operators(request['operators'])
+        conf = request.get('config') or {}
+        if not isinstance(conf, dict):
+            raise RequestError(400, "config 应为 JSON 对象")
+        return request['operators'], conf
+    raise RequestError(400, "需要 user_hash，或 operators + config")
+
+
+def validate_operators(operators):
+    """检查内联干员数据的结构（与 operators.json 相同），缺字段或类型不对时返回 400 而不是在计算中出错"""
+    for i, op in enumerate(operators):
+        if not isinstance(op, dict):
+            raise RequestError(400, f"operators[{i}] 应为 JSON 对象")
+        missing = [key for key in OPERATOR_FIELDS if key not in op]
+        if missing:
+            raise RequestError(400, f"operators[{i}] 缺少字段: {', '.join(missing)}")
+        if not isinstance(op['name'], str) or not op['name']:
+            raise RequestError(400, f"operators[{i}].name 应为非空字符串")
+        if not isinstance(op['own'], bool):
+            raise RequestError(400, f"operators[{i}].own 应为 true/false")
+        for key in ('elite', 'level', 'potential', 'rarity'):
+            if not isinstance(op[key], int) or isinstance(op[key], bool):
+                raise RequestError(400, f"operators[{i}].{key} 应为整数")
+
+
+def analyze_task(request):
+    """在 worker 进程中执行一次分析；错误以 {"error", "status"} 返回，避免异常跨进程传递"""
+    try:
+        ops, conf = load_request_data(request)
+        if 'user_hash' in request:
+            # 已存储的客户：用上次的结果热启动，分析后写回
+            warm_start = os.path.join(USER_DATA_DIR, request['user_hash'], WARM_START_FILE)
+            result = {"user_hash": request['user_hash'], **logic.analyze_roster(ops, conf, warm_start=warm_start)}
+        else:
+            result = logic.analyze_roster(ops, conf)
+        return result
+    except RequestError as e:
+        return {"error": str(e), "status": e.status}
+    except Exception as e:
+        return {"error": f"计算出错: {e}", "status": 500}
+
+
+def _warm_up(_):
+    return os.getpid()
+
+
+# ==========================================
+# 2. 服务端
+# ==========================================
+
+class SchedulingService:
+    """持有规则库注册表与预先启动的进程池；规则库版本变化时换用新进程池，进行中的请求在旧池中完成"""
+
+    def __init__(self, efficiency_file="efficiency.json", workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.registry = logic.RulebookRegistry(efficiency_file).start()
+        self._lock = threading.Lock()
+        self._pool, self._pool_version = self._create_pool()
+
+    def _create_pool(self):
+        rulebook = self.registry.current()
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=logic._init_worker,
+                                   initargs=(rulebook,))
+        # 预先拉起全部 worker（各自加载一次规则库），第一个请求不用等进程启动
+        list(pool.map(_warm_up, range(self.workers)))
+        return pool, rulebook.version
+
+    def submit(self, requests):
+        """
+        把请求提交到当前进程池，返回 futures。
+        换池和提交都在锁内完成：旧池只会在没有线程正往它提交时关闭，
+        关闭时已提交的任务照常执行完（shutdown 不取消排队中的任务）。
+        """
+        with self._lock:
+            if self.registry.current().version != self._pool_version:
+                old_pool = self._pool
+                self._pool, self._pool_version = self._create_pool()
+                old_pool.shutdown(wait=False)
+            return [self._pool.submit(analyze_task, request) for request in requests]
+
+    def analyze(self, request):
+        return self.submit([request])[0].result()
+
+    def batch(self, requests):
+        return [future.result() for future in self.submit(requests)]
+
+    def shutdown(self):
+        self._pool.shutdown()
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length <= 0 or length > MAX_BODY_BYTES:
+                raise RequestError(400, "请求体为空或过大")
+            try:
+                return json.loads(self.rfile.read(length).decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                raise RequestError(400, "请求体不是合法的 JSON")
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok", "rulebook_version": service.registry.version,
+                                 "workers": service.workers})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            try:
+                if self.path == "/analyze":
+                    result = service.analyze(self._read_json())
+                    self._send(result.pop("status", 200) if "error" in result else 200, result)
+                elif self.path == "/batch":
+                    body = self._read_json()
+                    if not isinstance(body, dict) or not isinstance(body.get("requests"), list):
+                        raise RequestError(400, "需要 requests 列表")
+                    results = service.batch(body["requests"])
+                    for result in results:
+                        result.pop("status", None)
+                    self._send(200, {"results": results})
+                else:
+                    self._send(404, {"error": "not found"})
+            except RequestError as e:
+                self._send(e.status, {"error": str(e)})
+            except Exception as e:
+                self._send(500, {"error": f"服务出错: {e}"})
+
+        def log_message(self, format, *args):
+            pass  # 关闭逐请求日志，压测时输出太多
+
+    return Handler
+
+
+def serve(host, port, workers, efficiency_file):
+    service = SchedulingService(efficiency_file, workers)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"✅ 排班服务已启动: http://{host}:{port}  (workers={service.workers}, "
+          f"rulebook={service.registry.version})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+# ==========================================
+# 3. 流量回放（压测）
+# ==========================================
+
+def replay(jsonl_path, url, concurrency):
+    """
+    按 JSONL 回放请求：每行是 {"path": "/analyze", "body": {...}}，或直接是 /analyze 的请求体。
+    输出成功/失败数、吞吐量与延迟分位数。
+    """
+    import urllib.error
+    import urllib.request
+
+    entries = []
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if isinstance(entry, dict) and "body" in entry:
+                    entries.append((entry.get("path", "/analyze"), entry["body"]))
+                else:
+                    entries.append(("/analyze", entry))
+
+    def send(entry):
+        path, body = entry
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(url.rstrip('/') + path, data=data,
+                                         headers={"Content-Type": "application/json"})
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except urllib.error.URLError:
+            status = 0
+        return status, time.perf_counter() - t0
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(send, entries))
+    elapsed = time.perf_counter() - t_start
+
+    latencies = sorted(latency for _, latency in outcomes)
+    ok = sum(1 for status, _ in outcomes if status == 200)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    print(f"请求 {len(outcomes)} 条，成功 {ok}，失败 {len(outcomes) - ok}，耗时 {elapsed:.2f} s，"
+          f"吞吐 {len(outcomes) / elapsed if elapsed else 0:.1f} req/s")
+    print(f"延迟 p50 {percentile(0.5):.0f} ms / p95 {percentile(0.95):.0f} ms / p99 {percentile(0.99):.0f} ms")
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MAA 基建排班 JSON 服务")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="启动服务")
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8765)
+    p_serve.add_argument("--workers", type=int, default=None, help="进程数，默认 CPU 核数")
+    p_serve.add_argument("--efficiency", default="efficiency.json")
+
+    p_replay = sub.add_parser("replay", help="回放 JSONL 请求做压测")
+    p_replay.add_argument("jsonl")
+    p_replay.add_argument("--url", default="http://127.0.0.1:8765")
+    p_replay.add_argument("--concurrency", type=int, default=8)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers, args.efficiency)
+    else:
+        outcomes = replay(args.jsonl, args.url, args.concurrency)
+        sys.exit(0 if all(status == 200 for status, _ in outcomes) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from logic import WorkplaceOptimizer  # noqa: E402
+
+EFFICIENCY_FILE = os.path.join(ROOT, "efficiency.json")
+SAMPLE_USER = os.path.join(ROOT, "user_data", "abdecc0fe19896cd")
+
+
+def load_sample():
+    with open(os.path.join(SAMPLE_USER, "operators.json"), 'r', encoding='utf-8') as f:
+        ops = json.load(f)
+    with open(os.path.join(SAMPLE_USER, "config.json"), 'r', encoding='utf-8') as f:
+        conf = json.load(f)
+    return ops, conf
+
+
+def upgrade_advice(ops, conf):
+    optimizer = WorkplaceOptimizer(EFFICIENCY_FILE, None, operator_data=ops, config_data=conf)
+    current = optimizer.get_optimal_assignments(ignore_elite=False)
+    potential = optimizer.get_optimal_assignments(ignore_elite=True)
+    return optimizer.calculate_upgrade_requirements(current, potential)
+
+
+def test_upgrade_advice_independent_of_minimize_swaps():
+    ops, conf = load_sample()
+    swapped = upgrade_advice(ops, dict(conf, minimize_swaps=True))
+    unswapped = upgrade_advice(ops, dict(conf, minimize_swaps=False))
+    assert swapped == unswapped
+    assert any(item.get('name') == '吉星' and item['rooms'] == '贸易站3' for item in swapped)
+
+
+def plan_outline(results):
+    return [(res.workplace.id, res.total_efficiency, [op.name for op in res.optimal_operators])
+            for res in results["raw_results"]]
+
+
+def test_engines_agree_with_shift_unavailable():
+    pytest.importorskip("numpy")
+    ops, conf = load_sample()
+    outlines = []
+    for engine in ("python", "numpy"):
+        optimizer = WorkplaceOptimizer(EFFICIENCY_FILE, None, operator_data=ops, config_data=conf, engine=engine)
+        outlines.append([plan_outline(optimizer.get_optimal_assignments(shift_unavailable={shift: {name}}))
+                         for name in ("戴菲恩", "八幡海铃") for shift in range(3)])
+    assert outlines[0] == outlines[1]
+
+
+def test_warm_start_keeps_only_selected_plan_rooms():
+    ops, conf = load_sample()
+    optimizer = WorkplaceOptimizer(EFFICIENCY_FILE, None, operator_data=ops, config_data=conf)
+    optimizer.enable_warm_start()
+    alternatives = optimizer.get_top_k_assignments(k=3, ignore_elite=False, max_evaluations=10)
+    best = alternatives[0]["result"]
+    state = optimizer.warm_start_state(best)
+    assert [key for key, _ in state["rooms"]] == list(dict(best["warm_rooms"]))
+
+    warm = WorkplaceOptimizer(EFFICIENCY_FILE, None, operator_data=ops, config_data=conf)
+    assert warm.load_warm_start(state)["kept"] == len(state["rooms"])
+    assert plan_outline(warm.get_optimal_assignments(ignore_elite=False)) == plan_outline(best)
+    assert warm.room_cache_stats['misses'] == 0